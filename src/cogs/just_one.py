@@ -1,13 +1,15 @@
 import asyncio
 
+import discord
 from discord.ext import commands, tasks
 
 import game_management.output as output
 import utils as ut
 from environment import PREFIX, CHECK_EMOJI, DISMISS_EMOJI
 from game_management.game import Game, find_game, games
+from game_management.reaction_dispatcher import dispatcher
 from game_management.tools import Phase, Group, Key
-from game_management.word_pools import compute_current_distribution, getword
+from game_management.word_pools import compute_current_distribution, draw_word
 from log_setup import logger, channel_prefix
 
 
@@ -32,36 +34,35 @@ class JustOne(commands.Cog):
                            f'*Default hints per players* 3,2 and 1 for 1,2 and at least 3 participants respectively')
     async def play(self, ctx: commands.Context, *args):
         logger.debug(f'{channel_prefix(ctx.channel)}Play command found.')
-        compute_current_distribution(ctx=ctx)
         guesser = ctx.author
         text_channel = ctx.channel
-        for game in games:
-            if game.channel.id == text_channel.id:
-                logger.debug(f'{channel_prefix(ctx.channel)}Found a game in the channel in phase {game.phase}...')
-                if not (game.phase.value >= 130):  # Check if the game has a summary already
-                    logger.debug(f'{channel_prefix(ctx.channel)}...game is still playing, aborting play command and '
-                                 f'sending warning message')
-                    await game.message_sender.send_message(
-                        embed=output.already_running(),
-                        reaction=False,
-                        group=Group.warn
+        game = find_game(text_channel)
+        if game is not None:
+            logger.debug(f'{channel_prefix(ctx.channel)}Found a game in the channel in phase {game.phase}...')
+            if not (game.phase.value >= 130):  # Check if the game has a summary already
+                logger.debug(f'{channel_prefix(ctx.channel)}...game is still playing, aborting play command and '
+                             f'sending warning message')
+                await game.message_sender.send_message(
+                    embed=output.already_running(),
+                    reaction=False,
+                    group=Group.warn
+                )
+                return  # We found a game that is already running
+            elif game.phase == Phase.show_summary:  # If the game is finished but not stopped, stop it
+                logger.debug(f'{channel_prefix(ctx.channel)}...game can be stopped, stopping')
+                game.phase_handler.advance_to_phase(Phase.stopping)
+        # Now we are ready to start a new game
+        logger.debug(f'{channel_prefix(ctx.channel)}Initialising new game, as no game is running or old game has '
+                     f'been stopped')
+        game = Game(text_channel, guesser, bot=self.bot,
+                    word_pool_distribution=await compute_current_distribution(ctx=ctx),
+                    participants=ut.get_members_from_args(ctx.guild, args),
+                    expected_tips_per_person=ut.get_expected_number_of_tips_from_args(args)
                     )
-                    break  # We found a game that is already running, so break the loop
-                elif game.phase == Phase.show_summary:  # If the game is finished but not stopped, stop it
-                    logger.debug(f'{channel_prefix(ctx.channel)}...game can be stopped, stopping')
-                    game.phase_handler.advance_to_phase(Phase.stopping)
-        else:  # Now - if the loop did not break - we are ready to start a new game
-            logger.debug(f'{channel_prefix(ctx.channel)}Initialising new game, as no game is running or old game has '
-                         f'been stopped')
-            game = Game(text_channel, guesser, bot=self.bot,
-                        word_pool_distribution=compute_current_distribution(ctx=ctx),
-                        participants=ut.get_members_from_args(ctx.guild, args),
-                        expected_tips_per_person=ut.get_expected_number_of_tips_from_args(args)
-                        )
-
-            games.append(game)
-            game.play()
-            logger.debug(f'{channel_prefix(ctx.channel)}Started new game')
+
+        games.add(game)
+        game.play()
+        logger.debug(f'{channel_prefix(ctx.channel)}Started new game')
 
     @commands.command(name='rules', help='Show the rules of this game.')
     async def rules(self, ctx):
@@ -124,60 +125,32 @@ class JustOne(commands.Cog):
 
     @commands.command(name='draw', help='Draw a word from the current wordpool.')
     async def draw_word(self, ctx):
-        distribution = compute_current_distribution(ctx=ctx)
+        distribution = await compute_current_distribution(ctx=ctx)
         await ctx.send(embed=ut.make_embed(
             title="Ein Wort für dich!",
-            value=f"Dein Wort lautet: `{getword(distribution)}`. Viele Spaß damit!"
+            value=f"Dein Wort lautet: `{await draw_word(distribution)}`. Viele Spaß damit!"
         )
         )
         logger.info(f'Drew a word from Distribution: {distribution}')
 
     @commands.Cog.listener()
-    async def on_message(self, message):
-        logger.debug(f'{on_message_prefix(message)}Got a message, trying to find game in channel '
-                     f'{message.channel.id}...')
-        channel = message.channel
-        game = find_game(channel)
-        if game is None:
-            logger.debug(f'{on_message_prefix(message)}No game found in channel, nothing to do')
-            return  # since no game is running in this channel, nothing has to be done
-
-        logger.debug(f'{on_message_prefix(message)}Found game with id {game.id} in phase {game.phase} in the current'
-                     f'channel. Further handling of the message is needed')
-        if message.author.bot:
-            if message.author.id == message.channel.guild.me.id:
-                logger.debug(f'{on_message_prefix(message)}Message was written by myself, ignoring it.')
-            else:
-                game.message_sender.message_handler.add_message_to_group(message, Group.other_bot)
-                logger.debug(f'{on_message_prefix(message)}Message was written by other bot, added it to group '
-                             f'{Group.other_bot} of the running game {game.id}')
-
-        elif message.content.startswith(PREFIX):
-            game.message_sender.message_handler.add_message_to_group(message, Group.own_command_invocation)
-            logger.debug(f'{on_message_prefix(message)}Message is a command for myself, added it to group '
-                         f'{Group.own_command_invocation} of game {game.id}')
-        #  We now know that 1) there is game running in the current channel and 2) the message was sent by a real user
-        #  and 3) the message is not a command for our bot.
-        elif game.phase == Phase.wait_collect_hints:  # Check if game collects hints
-            # Check if we have to delete the message
-            if not game.closed_game or message.author in game.participants:
-                await message.delete()
-                logger.debug(f'{on_message_prefix(message)}Message was deleted as it will be processed as a hint by '
-                             f'the game')
-            await game.add_hint(message)
-        elif game.phase == Phase.wait_for_guess:  # Check if game is waiting for a guess
-            #  Check if message is from the guesser, if not, it is regular chat
-            if message.author == game.guesser:
-                logger.debug(f'{on_message_prefix(message)}Message will be the guess of the game, nothing to do')
-                return
-        else:  # Message has to be regular chat
-            game.message_sender.message_handler.add_message_to_group(message, group=Group.user_chat)
-            logger.debug(f'{on_message_prefix(message)}Message was added to group {Group.user_chat} of the game, '
-                         f'as it is not a hint or the guess for the game.')
-
-
-def on_message_prefix(message):
-    return f'[Message listener] [Message {message.id}] '
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        dispatcher.dispatch(payload)  # Waiters can be in any channel, e.g. in the admin channel
+        game = games.find(channel_id=payload.channel_id)
+        if game is not None:
+            game.reaction_tally.add(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        game = games.find(channel_id=payload.channel_id)
+        if game is not None:
+            game.reaction_tally.remove(payload)
+
+    @commands.Cog.listener()
+    async def on_disconnect(self):
+        # Reaction events are not replayed after reconnecting, so the tallies might be outdated from now on
+        for game in games:
+            game.reaction_tally.mark_stale()
 
 
 # Setup the bot if this extension is loaded
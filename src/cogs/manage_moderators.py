@@ -1,13 +1,12 @@
 import discord
 from discord.ext import commands
 
-import database.db as db
 import database.db_access as dba
 import utils as ut
 from cogs.settings import is_arg
 from environment import PREFIX
 from permission_management.admin import is_guild_admin
-from permission_management.moderator import get_mod_roles
+from permission_management.moderator import get_mod_roles, is_mod_role, add_mod_role, remove_mod_role, prune_mod_role
 from log_setup import logger
 
 help_toggle_mod_usage = f"`{PREFIX}mrole [@role | role_id]`"
@@ -58,14 +57,12 @@ class Access(commands.Cog):
                     color=ut.yellow
                 )
             )
+            return
 
-        # try to get entry like this from database
-        session = db.open_session()
-        entry = dba.get_setting(ctx.guild.id, str(id_input), setting='mod-role', session=session)
         # wiping entry if exists to delete privileges
-        if entry:
-            session.delete(entry)
-            session.commit()
+        if is_mod_role(ctx.guild.id, id_input):
+            remove_mod_role(ctx.guild.id, id_input)
+            await dba.del_setting(ctx.guild.id, str(id_input), setting='mod-role')
             await ctx.send(
                 embed=ut.make_embed(
                     name='Removed privileges',
@@ -77,7 +74,8 @@ class Access(commands.Cog):
             return
 
         # we need to add a user if we reach this point - let's go
-        dba.add_setting(ctx.guild.id, str(id_input), setting='mod-role', set_by=ctx.author.id)
+        add_mod_role(ctx.guild.id, id_input)
+        await dba.add_setting(ctx.guild.id, str(id_input), setting='mod-role', set_by=ctx.author.id)
         await ctx.send(
             embed=ut.make_embed(
                 name='Added privileges',
@@ -112,6 +110,10 @@ class Access(commands.Cog):
             )
         )
 
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        prune_mod_role(role.guild, role.id)
+
 
 def setup(bot: commands.Bot):
     bot.add_cog(Access(bot))
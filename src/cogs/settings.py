@@ -9,13 +9,18 @@ from discord.ext import commands
 import discord
 
 import utils as ut
-import database.db as db
 import database.db_access as dba
-from environment import PREFIX
-from game_management.word_pools import available_word_pools, get_description, get_words
+from environment import PREFIX, NUMBER_EMOJIS
+from game_management.custom_pools import get_custom_pool_names, import_pool, remove_pool, POOL_NAME_PATTERN
+from game_management.guild_options import get_option, set_option
+from game_management.lockout import strategies as lockout_strategies, DEFAULT_LOCKOUT
+from game_management.word_pools import available_word_pools, get_description, get_words, registry, \
+    invalidate_distribution
 from permission_management.moderator import is_moderator
 from log_setup import logger
 
+REVIEW_MODES = ['per-hint', 'single']  # The first one is the default
+
 
 def get_list_formatted(format_symbol="_", join_style="\n") -> str:
     """
@@ -29,14 +34,21 @@ def get_list_formatted(format_symbol="_", join_style="\n") -> str:
     return join_style.join(nice_list)
 
 
-def get_set_lists(guild_id) -> str:
+async def get_set_lists(guild_id) -> str:
     """
     Get a beautiful string of all activated lists for that guild
 
     :returns: formatted string containing list or hint that list is empty
     """
-    active_settings = dba.get_settings_for(guild_id, setting="wordlist")
-    return "\n".join(sorted([f'{s.value} - {len(get_words(s.value))} words - weighted {s.weight} times'
+    active_settings = await dba.get_settings_for(guild_id, setting="wordlist")
+    custom_pools = await dba.get_custom_pools(guild_id) if active_settings else None
+    sizes = {pool.name: pool.size for pool in custom_pools} if custom_pools else {}
+
+    def size(list_name: str) -> int:
+        words = get_words(list_name)
+        return len(words) if words else sizes.get(list_name, 0)
+
+    return "\n".join(sorted([f'{s.value} - {size(s.value)} words - weighted {s.weight} times'
                              for s in active_settings])) if active_settings \
         else f"None - use `{PREFIX}enlist [list_name]` to add a list\n" \
              f"Or enter `{PREFIX}help settings` for more information"
@@ -108,7 +120,7 @@ async def validate_list_name(ctx: commands.Context, selection: Tuple, command_na
 
     # TODO: check if more than one input maybe enable two list at once?
     selected_list = selection[0]
-    if selected_list not in available_word_pools():
+    if selected_list not in available_word_pools() and selected_list not in await get_custom_pool_names(ctx.guild.id):
         await ctx.send(embed=ut.make_embed(
             name="Wrong argument", color=ut.yellow,
             value="Hey, you need to enter a wordlist.\n"
@@ -161,12 +173,18 @@ class Wordpools(commands.Cog):
                 name=wordpool,
                 value=(get_description(wordpool) + f" ({len(get_words(wordpool))} Wörter)")
             )
+        custom_pools = await dba.get_custom_pools(ctx.guild.id)
+        for pool in sorted(custom_pools, key=lambda p: p.name) if custom_pools else []:
+            embed.add_field(
+                name=f'{pool.name} (Server)',
+                value=(pool.description or "Eigener Wörterpool dieses Servers") + f" ({pool.size} Wörter)"
+            )
         await ctx.send(embed=embed)
 
     @commands.command(name="lists", alias=["show_lists"], help="Shows all activated list on your server")
     async def show_lists(self, ctx):
         # building a list which only contains values of the setting (list name), but only if list has entries
-        active_lists = get_set_lists(ctx.guild.id)
+        active_lists = await get_set_lists(ctx.guild.id)
         await ctx.send(embed=ut.make_embed(
             name="Your active lists are:", value=active_lists, color=ut.blue_light,
         )
@@ -197,8 +215,7 @@ class Wordpools(commands.Cog):
         weight, weight_msg = get_weight_arg(selection)
 
         # search for matching entries that already match in database
-        session = db.open_session()
-        already_active = dba.get_setting(ctx.guild.id, selected_list, setting="wordlist", session=session)
+        already_active = await dba.get_setting(ctx.guild.id, selected_list, setting="wordlist")
         # check if entry is there and has the same weight
 
         if already_active and already_active.weight == weight:
@@ -213,9 +230,8 @@ class Wordpools(commands.Cog):
 
         # if entry exists but weight is different - updating weight
         if already_active:
-            already_active.weight = weight
-            session.add(already_active)
-            session.commit()
+            await dba.set_setting_weight(ctx.guild.id, selected_list, weight, setting="wordlist")
+            invalidate_distribution(ctx.guild.id)
             await ctx.send(embed=ut.make_embed(
                 name="Updated weight", color=ut.green,
                 value=f"List *{selected_list}* is already registered.\n"
@@ -225,12 +241,13 @@ class Wordpools(commands.Cog):
             return
 
         # no entry for the list exists - creating database entry
-        dba.add_setting(ctx.guild.id, selected_list, setting="wordlist", set_by=ctx.author.id, weight=weight)
+        await dba.add_setting(ctx.guild.id, selected_list, setting="wordlist", set_by=ctx.author.id, weight=weight)
+        invalidate_distribution(ctx.guild.id)
         await ctx.send(embed=ut.make_embed(
             name="Successfully added", color=ut.green,
             value=f"The list *{selected_list}* was activated.\n"
                   f"{weight_msg}\n\n"
-                  f"Your active lists are now:\n\n{get_set_lists(ctx.guild.id)}"
+                  f"Your active lists are now:\n\n{await get_set_lists(ctx.guild.id)}"
         )
         )
         logger.info(f'[Guild {ctx.guild.id} Enabled wordpool {selected_list} with weight {weight}')
@@ -249,8 +266,9 @@ class Wordpools(commands.Cog):
             return
 
         # deleting entry from database
-        dba.del_setting(ctx.guild.id, selected_list, setting="wordlist")
-        active_lists = get_set_lists(ctx.guild.id)
+        await dba.del_setting(ctx.guild.id, selected_list, setting="wordlist")
+        invalidate_distribution(ctx.guild.id)
+        active_lists = await get_set_lists(ctx.guild.id)
         await ctx.send(embed=ut.make_embed(
             name="Successfully removed",
             value=f"The wordpool *{selected_list}* was removed.\n\n"
@@ -261,5 +279,208 @@ class Wordpools(commands.Cog):
         logger.info(f'[Guild {ctx.guild.id}] Deactivated wordpool {selected_list}')
 
 
+    @commands.command(name="deck", aliases=["deck-mode", "no-repeat"],
+                      help="Toggle the deck mode for your server.\n"
+                           "In deck mode, no word is drawn twice until all words of your active lists have been drawn "
+                           "(respecting their weights), then the deck is shuffled again.\n\n"
+                           f"Usage: `{PREFIX}deck [on | off]`\n"
+                           "Default: off")
+    async def toggle_deck_mode(self, ctx: commands.Context, *selection):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        deck_mode = await dba.get_setting(ctx.guild.id, 'deck', setting='draw-mode') is not None
+        if not is_arg(selection) or selection[0] not in ['on', 'off']:
+            await ctx.send(embed=ut.make_embed(
+                name="Deck mode", color=ut.yellow,
+                value=f"The deck mode is currently *{'on' if deck_mode else 'off'}*.\n"
+                      f"Use `{PREFIX}deck [on | off]` to change this."
+            ))
+            return
+
+        enable = selection[0] == 'on'
+        if enable != deck_mode:
+            if enable:
+                await dba.add_setting(ctx.guild.id, 'deck', setting='draw-mode', set_by=ctx.author.id)
+            else:
+                await dba.del_setting(ctx.guild.id, 'deck', setting='draw-mode')
+            invalidate_distribution(ctx.guild.id)
+        await ctx.send(embed=ut.make_embed(
+            name="Updated deck mode", color=ut.green,
+            value=f"The deck mode is now *{'on' if enable else 'off'}*."
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Set deck mode to {enable}')
+
+    @commands.command(name="review", aliases=["review-mode"],
+                      help="Choose how the hints are shown for reviewing them.\n"
+                           "*single*: All hints in one message, veto a hint by reacting with its number. "
+                           f"Rounds with more than {len(NUMBER_EMOJIS)} hints use one message per hint anyways.\n"
+                           "*per-hint*: One message per hint.\n\n"
+                           f"Usage: `{PREFIX}review [single | per-hint]`\n"
+                           "Default: per-hint")
+    async def set_review_mode(self, ctx: commands.Context, *selection):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        if not is_arg(selection) or selection[0] not in REVIEW_MODES:
+            review_mode = await get_option(ctx.guild.id, 'review-mode', default=REVIEW_MODES[0])
+            await ctx.send(embed=ut.make_embed(
+                name="Review mode", color=ut.yellow,
+                value=f"The review mode is currently *{review_mode}*.\n"
+                      f"Use `{PREFIX}review [single | per-hint]` to change this."
+            ))
+            return
+
+        await set_option(ctx.guild.id, 'review-mode', selection[0], set_by=ctx.author.id)
+        await ctx.send(embed=ut.make_embed(
+            name="Updated review mode", color=ut.green,
+            value=f"The review mode is now *{selection[0]}*."
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Set review mode to {selection[0]}')
+
+    @commands.command(name="lockout", aliases=["lockout-mode"],
+                      help="Choose how the guesser is locked out of the channel while the others give hints.\n"
+                           "*overwrite*: A permission overwrite for the guesser in the channel.\n"
+                           "*role*: A role that can't read the channel. It is created once per channel and kept "
+                           "for later rounds.\n\n"
+                           f"Usage: `{PREFIX}lockout [overwrite | role]`\n"
+                           f"Default: {DEFAULT_LOCKOUT}")
+    async def set_lockout(self, ctx: commands.Context, *selection):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        if not is_arg(selection) or selection[0] not in lockout_strategies:
+            lockout = await get_option(ctx.guild.id, 'lockout', default=DEFAULT_LOCKOUT)
+            await ctx.send(embed=ut.make_embed(
+                name="Lockout", color=ut.yellow,
+                value=f"The guesser is currently locked out using *{lockout}*.\n"
+                      f"Use `{PREFIX}lockout [overwrite | role]` to change this."
+            ))
+            return
+
+        await set_option(ctx.guild.id, 'lockout', selection[0], set_by=ctx.author.id)
+        await ctx.send(embed=ut.make_embed(
+            name="Updated lockout", color=ut.green,
+            value=f"The guesser is now locked out using *{selection[0]}*."
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Set lockout to {selection[0]}')
+
+    @commands.command(name="upload", aliases=["upload-list", "custom-list"],
+                      help="Upload your own word list for your server. Attach a text file with one word per line.\n"
+                           "Uploading a list with an existing name replaces that list.\n\n"
+                           f"Usage: `{PREFIX}upload [list_name] [Optional: description]`\n"
+                           "List names may contain lowercase letters, digits, _ and -\n\n"
+                           f"Activate the list afterwards using `{PREFIX}enlist [list_name]`")
+    async def upload_list(self, ctx: commands.Context, *selection):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        if not is_arg(selection) or not ctx.message.attachments:
+            await ctx.send(embed=ut.make_embed(
+                name="Missing argument", color=ut.yellow,
+                value="Hey, you need to give a name and attach a text file with one word per line.\n"
+                      f"e.g. `{PREFIX}upload my_list`"
+            ))
+            return
+
+        name = selection[0]
+        if not POOL_NAME_PATTERN.match(name) or name in available_word_pools():
+            await ctx.send(embed=ut.make_embed(
+                name="Wrong argument", color=ut.yellow,
+                value="Hey, list names may only contain lowercase letters, digits, _ and - and must not be the name "
+                      f"of a built-in list.\nUse `{PREFIX}available` to see all existing lists."
+            ))
+            return
+
+        try:
+            added, skipped = await import_pool(ctx.message.attachments[0], ctx.guild.id, name,
+                                               description=' '.join(selection[1:]), set_by=ctx.author.id)
+        except Exception as e:
+            logger.error(f'[Guild {ctx.guild.id}] Importing custom pool {name} failed: {e}')
+            await ctx.send(embed=ut.make_embed(
+                name="Upload failed", color=ut.red,
+                value="I could not read your file, please try again."
+            ))
+            return
+        invalidate_distribution(ctx.guild.id)
+
+        await ctx.send(embed=ut.make_embed(
+            name="Successfully uploaded", color=ut.green,
+            value=f"The list *{name}* now contains {added} words.\n"
+                  f"Activate it using `{PREFIX}enlist {name} [Optional: weight]`.",
+            footer=f"Skipped {skipped} empty, too long or duplicate lines." if skipped else None
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Uploaded custom pool {name} with {added} words')
+
+    @commands.command(name="remove-list", aliases=["delete-list", "rmlist"],
+                      help="Delete a word list that was uploaded for your server.\n\n"
+                           f"Usage: `{PREFIX}remove-list [list_name]`")
+    async def remove_list(self, ctx: commands.Context, *selection):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        if not is_arg(selection) or selection[0] not in await get_custom_pool_names(ctx.guild.id):
+            await ctx.send(embed=ut.make_embed(
+                name="Wrong argument", color=ut.yellow,
+                value="Hey, you need to enter a list that was uploaded for your server.\n"
+                      f"Use `{PREFIX}available` for a list of all available word-lists."
+            ))
+            return
+
+        name = selection[0]
+        await dba.del_setting(ctx.guild.id, name, setting="wordlist")
+        await remove_pool(ctx.guild.id, name)
+        invalidate_distribution(ctx.guild.id)
+        await ctx.send(embed=ut.make_embed(
+            name="Successfully deleted",
+            value=f"The list *{name}* was deleted.\n\n"
+                  f"Your active wordpools are now:\n\n"
+                  f"{await get_set_lists(ctx.guild.id)}"
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Deleted custom pool {name}')
+
+    @commands.command(name="reload-pools", aliases=["reload-lists", "rlp"],
+                      help="Reload the word pools from disk without restarting the bot.\n\n"
+                           "_moderator permissions required_")
+    async def reload_wordpools(self, ctx: commands.Context):
+
+        # check if author is allowed to execute
+        if not is_moderator(ctx.author):
+            await send_permission_error(ctx)
+            return
+
+        try:
+            registry.reload()
+        except (OSError, ValueError) as e:
+            logger.error(f'[Guild {ctx.guild.id}] Manual reload of the word pools failed: {e}')
+            await ctx.send(embed=ut.make_embed(
+                name="Reload failed", color=ut.red,
+                value="The word pools could not be read, I keep using the previously loaded ones.\n"
+                      f"`{e}`"
+            ))
+            return
+
+        await ctx.send(embed=ut.make_embed(
+            name="Reloaded word pools", color=ut.green,
+            value=f"Loaded {len(registry.names)} word pools:\n\n{get_list_formatted()}"
+        ))
+        logger.info(f'[Guild {ctx.guild.id}] Reloaded the word pools manually')
+
+
 def setup(bot: commands.Bot):
     bot.add_cog(Wordpools(bot))
@@ -12,26 +12,52 @@ https://github.com/nonchris/discord-bot
 # core interface to the database
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import sqlalchemy.orm
 from sqlalchemy import create_engine, Boolean
 # base contains a metaclass that produces the right table
 from sqlalchemy.ext.declarative import declarative_base
 # setting up a class that represents our SQL Database
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index, UniqueConstraint
 # prints if a table was created - neat check for making sure nothing is overwritten
 from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from environment import DATABASE_WORKERS, DATABASE_BUSY_TIMEOUT
 
 if not os.path.exists('data/'):
     os.mkdir('data/')
 
-engine = create_engine('sqlite:///data/main.db', echo=False)
+# One pooled connection per worker thread. Connections are handed between threads by the pool, but never used by two
+# threads at the same time, so the same-thread check of sqlite can be disabled
+engine = create_engine('sqlite:///data/main.db', echo=False,
+                       connect_args={'timeout': DATABASE_BUSY_TIMEOUT, 'check_same_thread': False},
+                       poolclass=QueuePool, pool_size=DATABASE_WORKERS, max_overflow=0)
+# All queries run on these worker threads, so that they never block the event loop (see db_access.py)
+executor = ThreadPoolExecutor(max_workers=DATABASE_WORKERS, thread_name_prefix='database')
+Session = sessionmaker(bind=engine, expire_on_commit=False)  # Objects stay usable after their session is closed
 Base: declarative_base = declarative_base()
 
 logger = logging.getLogger('my-bot')
 
 
+@event.listens_for(engine, 'connect')
+def configure_connection(dbapi_connection, connection_record):
+    """
+    Configures every new sqlite connection: In WAL mode readers never wait for writers (and vice versa), only writers
+    are serialized. synchronous=NORMAL is safe in WAL mode and avoids a fsync on every commit.
+    Writers wait up to DATABASE_BUSY_TIMEOUT seconds for each other instead of failing immediately.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(DATABASE_BUSY_TIMEOUT * 1000)}')
+    cursor.close()
+
+
 class Settings(Base):
     __tablename__ = 'SETTINGS'
 
@@ -74,6 +100,38 @@ class Resources(Base):
                f"value='{self.value}'>"
 
 
+class CustomPools(Base):
+    __tablename__ = 'CUSTOM_POOLS'
+
+    # word pools uploaded by the moderators of a guild, the words themselves are stored in CUSTOM_WORDS
+
+    id = Column(Integer, primary_key=True)
+    guild_id = Column(Integer, index=True)  # ID of guild the pool belongs to
+    name = Column(String)  # Name of the pool, used like the names of the built-in pools
+    description = Column(String)  # Description shown in the list of available pools
+    size = Column(Integer)  # Number of words in the pool, positions of the words are 0, ..., size - 1
+    set_by = Column(Integer)  # user id of person who uploaded the pool
+
+    def __repr__(self):
+        return f"<CustomPool: guild='{self.guild_id}', name='{self.name}', size='{self.size}'>"
+
+
+class CustomWords(Base):
+    __tablename__ = 'CUSTOM_WORDS'
+    __table_args__ = (
+        UniqueConstraint('pool_id', 'word'),  # No duplicate words in a pool
+        Index('ix_custom_words_position', 'pool_id', 'position', unique=True)  # Drawing a word by its position
+    )
+
+    id = Column(Integer, primary_key=True)
+    pool_id = Column(Integer)  # ID of the CustomPools entry the word belongs to
+    position = Column(Integer)  # Dense position of the word in its pool, used for drawing
+    word = Column(String)  # The (normalized) word
+
+    def __repr__(self):
+        return f"<CustomWord: pool='{self.pool_id}', position='{self.position}', word='{self.word}'>"
+
+
 @event.listens_for(Base.metadata, 'after_create')
 def receive_after_create(target, connection, tables, **kw):
     """listen for the 'after_create' event"""
@@ -83,9 +141,28 @@ def receive_after_create(target, connection, tables, **kw):
 
 def open_session() -> sqlalchemy.orm.Session:
     """
-    :return: new active session
+    :return: new active session, the caller is responsible for closing it. Prefer session_scope()
+    """
+    return Session()
+
+
+@contextmanager
+def session_scope() -> sqlalchemy.orm.Session:
+    """
+    Provides a session for one unit of work: It is committed if the block succeeds, rolled back otherwise and
+    closed in any case.
+
+    :return: context manager yielding a new session
     """
-    return sessionmaker(bind=engine)()
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 
 # creating db which doesn't happen when it should?
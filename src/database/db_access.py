@@ -3,23 +3,70 @@ Written by:
 https://github.com/nonchris/
 """
 
+import asyncio
+import functools
 import logging
 from typing import Union, List
 
-from sqlalchemy import select, and_, delete
+from sqlalchemy import select, and_, delete, update
 
 import database.db as db
 
 logger = logging.getLogger('my-bot')
 
+"""
+All functions of this file are coroutine functions: The queries run on the database worker threads (see db.py), so that
+they never block the event loop. Code that already runs on a database thread (see run_blocking) can use the blocking
+version of a function via its attribute `blocking`, e.g. get_setting.blocking(...)
+Each call is one unit of work: It runs in its own session that is committed and closed afterwards. Pass a session
+explicitly to the blocking versions to combine several calls into one unit of work.
+"""
+
+
+async def run_blocking(function, *args, **kwargs):
+    """
+    Runs a blocking function (that accesses the database) on the database worker thread
+
+    :param function: the function to run
+    :param args: positional arguments passed to the function
+    :param kwargs: keyword arguments passed to the function
+
+    :return: the return value of the function
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db.executor, functools.partial(function, *args, **kwargs))
+
+
+def on_database_thread(function):
+    """
+    Decorator that turns a blocking database function into a coroutine function running it via run_blocking.
+    The blocking function stays available as attribute `blocking`.
+    If no session is passed, the function gets a new session that is committed (or rolled back on errors) and closed
+    after the call.
+    """
+    @functools.wraps(function)
+    def blocking(*args, session=None, **kwargs):
+        if session is not None:
+            return function(*args, session=session, **kwargs)
+        with db.session_scope() as session:
+            return function(*args, session=session, **kwargs)
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(blocking, *args, **kwargs)
+
+    wrapper.blocking = blocking
+    return wrapper
+
 
-def get_settings_for(guild_id: int, setting="wordlist", session=db.open_session()) -> Union[List[db.Settings], None]:
+@on_database_thread
+def get_settings_for(guild_id: int, setting="wordlist", session=None) -> Union[List[db.Settings], None]:
     """
     Searches db for setting in a guild that matches the setting name
 
     :param guild_id: id of the guild to search for
     :param setting: name of the setting to search for
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
 
     :return: list of settings that match the given given setting name
     """
@@ -34,15 +81,34 @@ def get_settings_for(guild_id: int, setting="wordlist", session=db.open_session(
     return [entry[0] for entry in entries] if entries else None
 
 
+@on_database_thread
+def get_all_settings(setting="wordlist", session=None) -> Union[List[db.Settings], None]:
+    """
+    Searches db for the settings of all guilds that match the setting name
+
+    :param setting: name of the setting to search for
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: list of settings that match the given given setting name
+    """
+
+    sel_statement = select(db.Settings).where(
+        db.Settings.setting == setting
+    )
+    entries = session.execute(sel_statement).all()
+    return [entry[0] for entry in entries] if entries else None
+
+
+@on_database_thread
 def get_setting(guild_id: int, value: str,
-                setting="wordlist", session=db.open_session()) -> Union[db.Settings, None]:
+                setting="wordlist", session=None) -> Union[db.Settings, None]:
     """
     Searches db for one specific setting and returns if if exists
 
     :param guild_id: id of the guild to search for
     :param value: value of the setting to search for
     :param setting: name of the setting to search for
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
 
     :return: database entry if exists with those specific parameters, else None
     """
@@ -58,7 +124,8 @@ def get_setting(guild_id: int, value: str,
     return entry[0] if entry else None
 
 
-def add_setting(guild_id: int, value: str, setting="wordlist", set_by=0, session=db.open_session(), weight=1):
+@on_database_thread
+def add_setting(guild_id: int, value: str, setting="wordlist", set_by=0, session=None, weight=1):
     """
     Add an entry to the settings database
 
@@ -67,21 +134,65 @@ def add_setting(guild_id: int, value: str, setting="wordlist", set_by=0, session
     :param set_by: userid of the member who entered that setting - could be neat for logs
     :param setting: setting type to add
     :param weight: weight of the setting, actually only needed for wordlist settings
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
     """
     entry = db.Settings(guild_id=guild_id, setting=setting, value=value, set_by=set_by, weight=weight)
     session.add(entry)
-    session.commit()
 
 
-def del_setting(guild_id: int, value: str, setting="wordlist", session=db.open_session()):
+@on_database_thread
+def replace_setting(guild_id: int, value: str, setting="wordlist", set_by=0, session=None, weight=1):
+    """
+    Replace all entries of a setting in a guild by a single one. Useful for settings that only have one value per guild
+
+    :param guild_id: id the setting is in
+    :param value: new value of the setting
+    :param setting: setting type to replace
+    :param set_by: userid of the member who entered that setting - could be neat for logs
+    :param weight: weight of the setting, actually only needed for wordlist settings
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+    """
+    statement = delete(db.Settings).where(
+        and_(
+            db.Settings.guild_id == guild_id,
+            db.Settings.setting == setting
+        )
+    )
+    session.execute(statement)
+    session.add(db.Settings(guild_id=guild_id, setting=setting, value=value, set_by=set_by, weight=weight))
+
+
+@on_database_thread
+def set_setting_weight(guild_id: int, value: str, weight: int, setting="wordlist", session=None):
+    """
+    Update the weight of an entry of the settings table
+
+    :param guild_id: id the setting is in
+    :param value: value of the setting - probably name of a word-list
+    :param weight: new weight of the setting
+    :param setting: setting type to update
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+    """
+
+    statement = update(db.Settings).where(
+        and_(
+            db.Settings.guild_id == guild_id,
+            db.Settings.setting == setting,
+            db.Settings.value == value
+        )
+    ).values(weight=weight)
+    session.execute(statement)
+
+
+@on_database_thread
+def del_setting(guild_id: int, value: str, setting="wordlist", session=None):
     """
     Delete an entry from the settings table
 
     :param guild_id: id the setting is in
     :param value: value of the setting - probably name of a word-list
     :param setting: setting type to delete
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
     """
 
     statement = delete(db.Settings).where(
@@ -92,16 +203,16 @@ def del_setting(guild_id: int, value: str, setting="wordlist", session=db.open_s
         )
     )
     session.execute(statement)
-    session.commit()
 
 
-def get_resources_for(guild_id: int, resource_type="role", session=db.open_session()) -> Union[List[db.Settings], None]:
+@on_database_thread
+def get_resources_for(guild_id: int, resource_type="role", session=None) -> Union[List[db.Settings], None]:
     """
     Searches db for resource in a guild that matches the setting name
 
     :param guild_id: id of the guild to search for
     :param resource_type: name of the resource to search for
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
 
     :return: list of resources that match the given given setting name
     """
@@ -116,12 +227,13 @@ def get_resources_for(guild_id: int, resource_type="role", session=db.open_sessi
     return [entry[0] for entry in entries] if entries else None
 
 
-def get_resources(resource_type="role", session=db.open_session()) -> Union[List[db.Resources], None]:
+@on_database_thread
+def get_resources(resource_type="role", session=None) -> Union[List[db.Resources], None]:
     """
     Searches db for resource of the given type
 
     :param resource_type: name of the resource to search for
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
     :return: list of resources that match the given role_type
     """
 
@@ -134,28 +246,29 @@ def get_resources(resource_type="role", session=db.open_session()) -> Union[List
     return [entry[0] for entry in entries] if entries else None
 
 
-def add_resource(guild_id: int, value: int, resource_type="role", session=db.open_session()):
+@on_database_thread
+def add_resource(guild_id: int, value: int, resource_type="role", session=None):
     """
     Add an entry to the settings database
 
     :param guild_id: id the resource is in
     :param value: value of the resource - probably a role or a text_channel
     :param resource_type: setting type to add
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
     """
     entry = db.Resources(guild_id=guild_id, resource_type=resource_type, value=value)
     session.add(entry)
-    session.commit()
 
 
-def del_resource(guild_id: int, value: int, resource_type="role", session=db.open_session()):
+@on_database_thread
+def del_resource(guild_id: int, value: int, resource_type="role", session=None):
     """
     Delete a resource from the settings table
 
     :param guild_id: id the setting is in
     :param value: value of the resource - probably a role or a text_channel
     :param resource_type: setting type to delete
-    :param session: session to search with, helpful if object shall be edited, since the same session is needed fo this.
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
     """
 
     statement = delete(db.Resources).where(
@@ -166,4 +279,158 @@ def del_resource(guild_id: int, value: int, resource_type="role", session=db.ope
         )
     )
     session.execute(statement)
-    session.commit()
+
+
+@on_database_thread
+def apply_resource_changes(additions: List[tuple], deletions: List[tuple], session=None):
+    """
+    Adds and deletes several resources in one transaction, used by the resource journal (see resource_journal.py)
+
+    :param additions: (guild_id, resource_type, value) of the resources to add
+    :param deletions: (guild_id, resource_type, value) of the resources to delete
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+    """
+    for (guild_id, resource_type, value) in additions:
+        add_resource.blocking(guild_id, value, resource_type=resource_type, session=session)
+    for (guild_id, resource_type, value) in deletions:
+        del_resource.blocking(guild_id, value, resource_type=resource_type, session=session)
+
+
+@on_database_thread
+def get_custom_pools(guild_id: int, session=None) -> Union[List[db.CustomPools], None]:
+    """
+    Searches db for the custom word pools of a guild
+
+    :param guild_id: id of the guild to search for
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: list of custom pools of the guild
+    """
+
+    sel_statement = select(db.CustomPools).where(
+        db.CustomPools.guild_id == guild_id
+    )
+    entries = session.execute(sel_statement).all()
+    return [entry[0] for entry in entries] if entries else None
+
+
+@on_database_thread
+def get_custom_pool(guild_id: int, name: str, session=None) -> Union[db.CustomPools, None]:
+    """
+    Searches db for one specific custom word pool of a guild
+
+    :param guild_id: id of the guild to search for
+    :param name: name of the pool
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: database entry if exists, else None
+    """
+
+    sel_statement = select(db.CustomPools).where(
+        and_(
+            db.CustomPools.guild_id == guild_id,
+            db.CustomPools.name == name
+        )
+    )
+    entry = session.execute(sel_statement).first()
+    return entry[0] if entry else None
+
+
+@on_database_thread
+def add_custom_pool(guild_id: int, name: str, description: str, set_by=0, session=None) -> int:
+    """
+    Add an (empty) custom word pool, fill it with add_custom_words()
+
+    :param guild_id: id of the guild the pool belongs to
+    :param name: name of the pool
+    :param description: description of the pool
+    :param set_by: userid of the member who uploaded the pool
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: id of the new pool
+    """
+    entry = db.CustomPools(guild_id=guild_id, name=name, description=description, size=0, set_by=set_by)
+    session.add(entry)
+    session.flush()  # Assigns the id
+    return entry.id
+
+
+@on_database_thread
+def add_custom_words(pool_id: int, words: List[str], session=None) -> int:
+    """
+    Append a batch of words to a custom word pool, skipping words that are already contained in the pool.
+    Meant to be called with batches of limited size, so that huge pools can be imported piece by piece.
+
+    :param pool_id: id of the pool to add the words to
+    :param words: the (normalized) words to add
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: number of words that were actually added
+    """
+    words = list(dict.fromkeys(words))  # Deduplicate the batch itself while keeping the order
+    sel_statement = select(db.CustomWords.word).where(
+        and_(
+            db.CustomWords.pool_id == pool_id,
+            db.CustomWords.word.in_(words)
+        )
+    )
+    existing = set(session.execute(sel_statement).scalars().all())
+    words = [word for word in words if word not in existing]
+    if not words:
+        return 0
+    size = session.execute(select(db.CustomPools.size).where(db.CustomPools.id == pool_id)).scalar_one()
+    session.add_all([db.CustomWords(pool_id=pool_id, position=size + i, word=word) for (i, word) in enumerate(words)])
+    session.execute(update(db.CustomPools).where(db.CustomPools.id == pool_id).values(size=size + len(words)))
+    return len(words)
+
+
+@on_database_thread
+def get_custom_word(pool_id: int, position: int, session=None) -> Union[str, None]:
+    """
+    Get a word of a custom pool by its position
+
+    :param pool_id: id of the pool
+    :param position: position of the word, between 0 and the size of the pool
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+
+    :return: the word if exists, else None
+    """
+
+    sel_statement = select(db.CustomWords.word).where(
+        and_(
+            db.CustomWords.pool_id == pool_id,
+            db.CustomWords.position == position
+        )
+    )
+    return session.execute(sel_statement).scalar()
+
+
+@on_database_thread
+def replace_custom_pool(guild_id: int, name: str, pool_id: int, session=None):
+    """
+    Replace a custom word pool by another one (e.g. one imported under a temporary name) in one transaction: The pool
+    with the given name is deleted and the other pool gets its name
+
+    :param guild_id: id of the guild the pools belong to
+    :param name: name of the pool to replace
+    :param pool_id: id of the pool that replaces it
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+    """
+    del_custom_pool.blocking(guild_id, name, session=session)
+    session.execute(update(db.CustomPools).where(db.CustomPools.id == pool_id).values(name=name))
+
+
+@on_database_thread
+def del_custom_pool(guild_id: int, name: str, session=None):
+    """
+    Delete a custom word pool including its words
+
+    :param guild_id: id of the guild the pool belongs to
+    :param name: name of the pool
+    :param session: session to use. If not given, the call runs in its own session (see on_database_thread)
+    """
+    pool = get_custom_pool.blocking(guild_id, name, session=session)
+    if pool is None:
+        return
+    session.execute(delete(db.CustomWords).where(db.CustomWords.pool_id == pool.id))
+    session.delete(pool)
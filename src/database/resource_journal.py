@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import Dict, Set, Tuple, Union
+
+import database.db_access as dba
+from environment import RESOURCE_FLUSH_INTERVAL
+
+logger = logging.getLogger('my-bot')
+
+"""
+Write-behind journal for the RESOURCES table. Games create and delete their roles and channels several times per round,
+so the corresponding database rows are buffered here and written in a single transaction every RESOURCE_FLUSH_INTERVAL
+seconds (and on shutdown) instead of one commit per change.
+A resource that is created and deleted again before the next flush never reaches the database at all.
+
+Rows that were not flushed before a crash are lost, so on_ready additionally cleans up resources by their names
+(see main.py) - the table is only a record of what to delete, never the only one.
+"""
+
+ResourceKey = Tuple[int, str, int]  # (guild_id, resource_type, value)
+
+
+class ResourceJournal:
+    def __init__(self, interval: float = RESOURCE_FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending: Dict[ResourceKey, bool] = {}  # True if the row has to be added, False if it has to be deleted
+        self.flush_handle: Union[asyncio.TimerHandle, None] = None
+        self.flush_lock: Union[asyncio.Lock, None] = None  # Keeps flushes in order, created on the running loop
+        self.flush_tasks: Set[asyncio.Task] = set()  # Strong references to the running scheduled flushes
+
+    def add(self, guild_id: int, value: int, resource_type="role"):
+        """
+        Records a created resource
+
+        :param guild_id: id the resource is in
+        :param value: value of the resource - probably a role or a text_channel
+        :param resource_type: type of the resource
+        """
+        self.pending[(guild_id, resource_type, value)] = True
+        self.schedule_flush()
+
+    def delete(self, guild_id: int, value: int, resource_type="role"):
+        """
+        Records a deleted resource. If its creation has not been flushed yet, both cancel out.
+
+        :param guild_id: id the resource is in
+        :param value: value of the resource - probably a role or a text_channel
+        :param resource_type: type of the resource
+        """
+        key = (guild_id, resource_type, value)
+        if self.pending.get(key):
+            del self.pending[key]
+            return
+        self.pending[key] = False
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_handle is not None:
+            return
+        loop = asyncio.get_event_loop()
+        self.flush_handle = loop.call_later(self.interval, self.start_flush)
+
+    def start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    def take_pending(self) -> Tuple[list, list]:
+        """
+        Empties the journal
+
+        :return: the rows to add and the rows to delete
+        """
+        pending, self.pending = self.pending, {}
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        additions = [key for (key, added) in pending.items() if added]
+        deletions = [key for (key, added) in pending.items() if not added]
+        return additions, deletions
+
+    def restore_pending(self, additions: list, deletions: list):
+        """
+        Puts rows that could not be written back into the journal, unless they have been superseded in the meantime
+        """
+        for key in additions:
+            self.pending.setdefault(key, True)
+        for key in deletions:
+            self.pending.setdefault(key, False)
+
+    async def flush(self):
+        """
+        Writes all buffered rows to the database in one transaction
+        """
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            additions, deletions = self.take_pending()
+            if not additions and not deletions:
+                return
+            try:
+                await dba.apply_resource_changes(additions, deletions)
+            except Exception as e:
+                logger.error(f'[Resources] Could not write {len(additions) + len(deletions)} resource changes, '
+                             f'retrying later: {e}')
+                self.restore_pending(additions, deletions)
+                self.schedule_flush()
+                return
+        logger.debug(f'[Resources] Wrote {len(additions)} added and {len(deletions)} deleted resources')
+
+    def flush_blocking(self):
+        """
+        Writes all buffered rows to the database, blocking. Used on shutdown when the event loop is no longer running.
+        """
+        self.flush_handle = None  # The handle belongs to the closed event loop
+        additions, deletions = self.take_pending()
+        if additions or deletions:
+            dba.apply_resource_changes.blocking(additions, deletions)
+            logger.info(f'[Resources] Wrote {len(additions)} added and {len(deletions)} deleted resources on shutdown')
+
+
+journal = ResourceJournal()
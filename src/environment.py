@@ -35,9 +35,21 @@ DISMISS_EMOJI = '\u274C'
 SKIP_EMOJI = '\u23ed'
 PLAY_AGAIN_CLOSED_EMOJI = '\U0001f501'
 PLAY_AGAIN_OPEN_EMOJI = '\u21a9'
+# Keycap emojis 1 to 10, used to veto hints if all hints are reviewed in a single message
+NUMBER_EMOJIS = [f'{digit}\ufe0f\u20e3' for digit in range(1, 10)] + ['\U0001f51f']
 DEFAULT_TIMEOUT = 600
+SHOW_WORD_UPDATE_INTERVAL = 1.5  # Minimal seconds between two updates of the list of players that have given hints
 ROLE_NAME = 'JustOne-Guesser'
 DEFAULT_DISTRIBUTION = [('classic_main', 1)]
+WORDPOOL_FILE = 'data/wordpools.json'  # Source of truth for the word pools
+WORDSTORE_FILE = 'data/wordpools.bin'  # Precompiled binary version, see game_management/word_store.py
+CUSTOM_POOL_MAX_WORDS = 1000000  # Maximal size of word pools uploaded by guilds
+DATABASE_WORKERS = 4  # Number of threads (and pooled connections) running database queries
+DATABASE_BUSY_TIMEOUT = 5.0  # Seconds a write waits for other writes before failing
+# Seconds created and deleted resources (roles, channels) are buffered before they are written to the database
+RESOURCE_FLUSH_INTERVAL = float(load_env("RESOURCE_FLUSH_INTERVAL", "2"))
+# Seconds an unused admin waiting room is kept for later rounds before it is deleted
+WAITING_ROOM_IDLE_TIMEOUT = float(load_env("WAITING_ROOM_IDLE_TIMEOUT", "900"))
 DEBUG_MODE = True
 
 #  "classic_main", "classic_weird", "extension_main", "extension_weird", "nsfw", "gandhi"]
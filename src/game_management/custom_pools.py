@@ -0,0 +1,160 @@
+import re
+import secrets
+import unicodedata
+from collections.abc import Sequence
+from typing import Dict, List, Tuple, Union
+
+import aiohttp
+import discord
+
+import database.db_access as dba
+from environment import CUSTOM_POOL_MAX_WORDS
+from log_setup import logger
+
+"""
+This file handles the word pools that moderators upload for their guild. The words are stored in the database and only
+read once they are drawn, so that pools of arbitrary size can be used without keeping them in memory.
+"""
+
+IMPORT_BATCH_SIZE = 500  # Number of words written to the database at once while importing
+MAX_WORD_LENGTH = 100
+POOL_NAME_PATTERN = re.compile(r'^[a-z0-9_\-]{1,32}$')
+STAGING_PREFIX = '~import~'  # Pools are imported under a temporary name starting with this, see import_pool
+
+# Increased whenever a custom pool of the guild is replaced or removed, so that compiled samplers notice it.
+# Indexed by guild id
+pool_generations: Dict[int, int] = {}
+
+
+def pool_generation(guild_id: Union[int, None]) -> int:
+    """
+    @param guild_id: The guild to check
+    @return: The generation of the custom pools of the guild, see pool_generations
+    """
+    return pool_generations.get(guild_id, 0)
+
+
+def bump_pool_generation(guild_id: int):
+    pool_generations[guild_id] = pool_generation(guild_id) + 1
+
+
+class CustomWordList(Sequence):
+    """
+    Read-only list of the words of a custom pool. Each access fetches exactly one word (by its position) from the
+    database, so only access it on the database thread.
+    Raises LookupError if the pool has been replaced or removed since the list was created.
+    """
+    def __init__(self, pool_id: int, size: int):
+        self.pool_id = pool_id
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('word index out of range')
+        word = dba.get_custom_word.blocking(self.pool_id, index)
+        if word is None:
+            raise LookupError(f'custom pool {self.pool_id} has been replaced or removed')
+        return word
+
+
+def get_custom_words(guild_id: int, name: str) -> Union[CustomWordList, None]:
+    """
+    Blocking, only call this on the database thread
+    @param guild_id: The guild to search the pool in
+    @param name: The name of the custom pool
+    @return: The words of the custom pool if it exists and is not empty. None otherwise
+    """
+    pool = dba.get_custom_pool.blocking(guild_id, name)
+    if pool is None or not pool.size:
+        return None
+    return CustomWordList(pool.id, pool.size)
+
+
+async def get_custom_pool_names(guild_id: int) -> List[str]:
+    """
+    @param guild_id: The guild to search in
+    @return: The names of the custom pools of the guild - sorted
+    """
+    pools = await dba.get_custom_pools(guild_id)
+    return sorted(pool.name for pool in pools if not pool.name.startswith(STAGING_PREFIX)) if pools else []
+
+
+def normalize_word(line: str) -> Union[str, None]:
+    """
+    Normalizes a line of an uploaded word list
+
+    @param line: The line to normalize
+    @return: The word in NFC form with collapsed whitespace, or None if the line is empty or too long
+    """
+    word = ' '.join(unicodedata.normalize('NFC', line).split())
+    if not word or len(word) > MAX_WORD_LENGTH:
+        return None
+    return word
+
+
+async def import_pool(attachment: discord.Attachment, guild_id: int, name: str, description: str,
+                      set_by: int) -> Tuple[int, int]:
+    """
+    Imports an uploaded text file (one word per line) as custom pool of a guild, replacing a pool with the same name.
+    The file is streamed line by line and written to the database in batches, so that it never has to be loaded into
+    memory at once. Words are normalized and deduplicated.
+    The pool is imported under a temporary name and only replaces the existing pool once the import succeeded, so a
+    failed upload keeps the existing pool and a pool is never drawn from while it is imported.
+
+    @param attachment: The uploaded text file
+    @param guild_id: The guild to import the pool for
+    @param name: The name of the pool
+    @param description: The description of the pool
+    @param set_by: id of the member that uploaded the pool
+    @return: Number of imported words and number of skipped lines (empty, too long or duplicate)
+    @raise ValueError: If the file does not contain any word
+    """
+    staging_name = f'{STAGING_PREFIX}{name}~{secrets.token_hex(4)}'
+    pool_id = await dba.add_custom_pool(guild_id, staging_name, description, set_by=set_by)
+    added = 0
+    lines = 0
+    batch: List[str] = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(attachment.url) as response:
+                response.raise_for_status()
+                async for line in response.content:
+                    lines += 1
+                    word = normalize_word(line.decode('utf-8', errors='replace').lstrip('\ufeff'))
+                    if word is None:
+                        continue
+                    batch.append(word)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        added += await dba.add_custom_words(pool_id, batch)
+                        batch = []
+                        if added >= CUSTOM_POOL_MAX_WORDS:
+                            break
+        if batch:
+            added += await dba.add_custom_words(pool_id, batch)
+        if not added:
+            raise ValueError('The uploaded file does not contain any word')
+        await dba.replace_custom_pool(guild_id, name, pool_id)
+    except Exception:
+        await dba.del_custom_pool(guild_id, staging_name)  # Don't keep half imported pools
+        raise
+    bump_pool_generation(guild_id)
+    logger.info(f'[Guild {guild_id}] Imported custom pool {name} with {added} words from {lines} lines')
+    return added, lines - added
+
+
+async def remove_pool(guild_id: int, name: str):
+    """
+    Deletes a custom pool of a guild
+
+    @param guild_id: The guild of the pool
+    @param name: The name of the pool
+    """
+    await dba.del_custom_pool(guild_id, name)
+    bump_pool_generation(guild_id)
@@ -1,28 +1,46 @@
 import asyncio
 import random
-from typing import List, Union
+from collections import Counter
+from typing import Dict, List, Union
 
 import discord
-from discord.ext import tasks
 
-import database.db_access as dba
 import game_management.output as output
 import utils as ut
 from environment import PLAY_AGAIN_CLOSED_EMOJI, PLAY_AGAIN_OPEN_EMOJI, PREFIX, CHECK_EMOJI, DISMISS_EMOJI, \
-    DEFAULT_TIMEOUT, ROLE_NAME
-from game_management.messages import MessageSender
+    DEFAULT_TIMEOUT, ROLE_NAME, SHOW_WORD_UPDATE_INTERVAL, NUMBER_EMOJIS
+from game_management.game_registry import GameRegistry
+from game_management.guild_options import get_option
+from game_management.lockout import LockoutStrategy, is_immune, make_lockout
+from game_management.messages import CoalescedEdit, MessageSender, fan_out
+from game_management.reaction_tally import ReactionTally
+from game_management.timer_wheel import Timer, wait_for, wheel
 from game_management.tools import Hint, Phase, evaluate, Key, Group
-from game_management.word_pools import getword, WordPoolDistribution
+from game_management.waiting_rooms import pool as waiting_rooms
+from game_management.word_pools import draw_word, release_word, reserve_word, WordPoolDistribution
 from log_setup import logger
 
-games = []  # Global variable (what a shame!) -> Where can i better put this and e.g. use a dictionary for channels?
+games = GameRegistry()  # All running games, indexed by channel, guesser and game id
+
+
+class NextRound:
+    """
+    Resources prepared for the next round while the summary of a round is shown (see Game.warm_up_next_round).
+    Each of them is None if it is not ready
+    """
+    def __init__(self, guesser: discord.Member):
+        self.guesser = guesser
+        self.word: Union[str, None] = None
+        self.draw: Union[asyncio.Future, None] = None  # Reservation of the word, see word_pools.reserve_word
+        self.lockout: Union[LockoutStrategy, None] = None  # Prepared, but not locked yet
+        self.admin_channel: Union[discord.TextChannel, None] = None  # Admin channel of the previous round
 
 
 class Game:
     def __init__(self, channel: discord.TextChannel, guesser: discord.Member, bot,
                  word_pool_distribution: WordPoolDistribution, admin_mode: Union[None, bool] = None,
                  participants: List[discord.Member] = [], repeation=False,
-                 quick_delete=True, expected_tips_per_person=0):
+                 quick_delete=True, expected_tips_per_person=0, next_round: Union[NextRound, None] = None):
         """
 
         @param channel: The channel to run the game in
@@ -49,14 +67,16 @@ class Game:
                 If set to a nonzero value, this parameter is used. If set to zero, the game chooses the number of tips
                 according on the number of players playing in the game as three, two and one hints for one, two and
                 at least three players, respectively
+        @param next_round: Resources the previous round has prepared for this one, if any
         """
         self.id = random.getrandbits(64)
         logger.debug(f'{self.game_prefix()}Constructor invoked')
         self.channel = channel
         self.guesser = guesser
-        self.guesser_overwrites = None  # channel specific overwrites of the guesser in the game channel
+        self.lockout: Union[LockoutStrategy, None] = None  # Locks the guesser out of the game channel
         self.guess = ""
         self.word = ""
+        self.announce_embed: Union[discord.Embed, None] = None  # Message announcing the word, rendered in advance
         self.hints: List[Hint] = []
         self.wordpool: WordPoolDistribution = word_pool_distribution
         self.abort_reason = ""
@@ -65,6 +85,18 @@ class Game:
 
         # Helper class that controls sending, indexing, editing and deletion of messages
         self.message_sender = MessageSender(self.channel.guild, channel)
+        # Updates of the show_word message while collecting hints, coalesced as hints often come in bursts
+        self.show_word_updater = CoalescedEdit(
+            self.message_sender, Key.show_word,
+            render=lambda: output.announce_word_updated(self.guesser, self.word, self.hints,
+                                                        closed_game=self.closed_game,
+                                                        expected_number_of_tips=self.expected_tips_per_person),
+            state=lambda: tuple(Counter(hint.author.id for hint in self.hints).items()),  # Who gave how many hints
+            interval=SHOW_WORD_UPDATE_INTERVAL
+        )
+
+        # Reactions to the messages in the game channel, kept up to date by the raw reaction listeners
+        self.reaction_tally = ReactionTally(bot.user.id)
 
         # Helper class to handle the phases
         self.phase_handler = PhaseHandler(self)
@@ -103,12 +135,21 @@ class Game:
         logger.debug(f'{self.game_prefix()}Expected hints per person now set to {self.expected_tips_per_person}')
 
         self.aborted = False
-        self.role_given = False
-        self.role: discord.Role = None
         self.phase = Phase.initialised
         self.won = None
         self.bot = bot
         self.clearing = True
+        self.guess_future: Union[asyncio.Future, None] = None  # Resolved with the message containing the guess
+        self.next_round: Union[NextRound, None] = None  # Prepared while the summary is shown
+        self.reserved_draw: Union[asyncio.Future, None] = None  # Word drawn by the previous round, maybe not ready
+        if next_round:  # Take over what the previous round has prepared
+            self.reserved_draw = next_round.draw
+            self.lockout = next_round.lockout
+            self.admin_channel = next_round.admin_channel
+            if next_round.word:
+                self.word = next_round.word
+                self.render_announcement()
+        self.stop_timer: Union[Timer, None] = None  # Stops the game if it is not played again after the summary
         logger.info(f'{self.game_prefix()}Initialised game with {len(self.participants)} participants. '
                     f'admin mode: {self.admin_mode}, '
                     f'closed game: {self.closed_game}, '
@@ -138,30 +179,71 @@ class Game:
         """
         self.phase_handler.advance_to_phase(Phase.preparation)
 
-    @tasks.loop(count=1)
     async def preparation(self):
         """
-        Preparation phase of the game. Includes giving a role to the guesser, setting up permissions for the channel
-        and finding out whether to play this game in admin_mode if needed.
+        Preparation phase of the game. Includes drawing the word, locking the guesser out of the channel and finding
+        out whether to play this game in admin_mode if needed.
+        The word is drawn and rendered first, the REST calls (announcing the round, the lockout and the admin channel)
+        run concurrently afterwards. The word itself is only shown after the lockout is in place and has been verified
+        to hide the channel, the game switches to admin mode otherwise.
         Starts Phase.wait_for_admin or Phase.show_word after finishing
         """
         self.logger_inform_phase()
-        await self.message_sender.send_message(output.round_started(
-            repeation=self.repeation, guesser=self.guesser, closed_game=self.closed_game, prefix=PREFIX
-        ), reaction=False)
-        await self.remove_guesser_from_channel()
+        if self.announce_embed is None:  # Not prepared by the previous round
+            await self.prepare_word()
 
         # We now have to activate the admin_mode if it is a) explicitly enabled or b) not specified, but the
-        # guesser can still read messages in the channel
-        self.guesser = await self.guesser.guild.fetch_member(self.guesser.id)
-        permissions = self.guesser.permissions_in(self.channel)  # Get permissions of the user in the channel
-        if (self.admin_mode is None and permissions and permissions.read_messages) or self.admin_mode is True:
-            await self.make_channel_for_admin()  # Creating admin channel
+        # guesser can't be locked out of the channel as they are an administrator (or the owner) of the guild
+        immune = is_immune(self.guesser)
+        smart_admin_mode = self.admin_mode is None
+        if smart_admin_mode:
+            self.admin_mode = immune
+        steps = [self.message_sender.send_message(output.round_started(
+            repeation=self.repeation, guesser=self.guesser, closed_game=self.closed_game, prefix=PREFIX
+        ), reaction=False)]
+        if not immune:  # A lockout has no effect on administrators
+            steps.append(self.remove_guesser_from_channel())
+        if self.admin_mode:
+            steps.append(self.make_channel_for_admin())
+        await asyncio.gather(*steps)
+
+        if not immune and not self.lockout.locked:
+            return  # The lockout failed and fatal_forbidden has been started, the word must not be shown
+        # Other permissions of the guesser (e.g. an allow of another role) can defeat the lockout
+        if not self.admin_mode and (immune or not self.lockout.hides_channel()):
+            if not smart_admin_mode:
+                logger.fatal(f'{self.game_prefix()}Guesser can still read the game channel, but admin mode is disabled')
+                self.phase_handler.start_task(Phase.fatal_forbidden)
+                return
+            logger.info(f'{self.game_prefix()}Guesser can still read the game channel, switching to admin mode')
+            await self.make_channel_for_admin()
+        if self.admin_mode:
+            if self.admin_channel:
+                # Show message so that Admin can quickly jump to the channel
+                await self.message_sender.send_message(reaction=False,
+                                                       embed=output.admin_mode_wait(self.guesser, self.admin_channel),
+                                                       key=Key.admin_wait)
             self.phase_handler.advance_to_phase(Phase.wait_for_admin)
         else:
             self.phase_handler.advance_to_phase(Phase.show_word)
 
-    @tasks.loop(count=1)
+    async def prepare_word(self):
+        """
+        Draws the word and renders the message announcing it, so that showing it later needs one request only
+        """
+        try:
+            if self.reserved_draw:  # The previous round has started drawing the word already
+                (self.word, _) = await self.reserved_draw
+        except Exception as e:
+            logger.warning(f'{self.game_prefix()}Could not draw the word in advance: {e}')
+        if not self.word:
+            self.word = await draw_word(self.wordpool)  # generate a word
+        self.render_announcement()
+
+    def render_announcement(self):
+        self.announce_embed = output.announce_word(self.guesser, self.word, closed_game=self.closed_game,
+                                                   expected_number_of_tips=self.expected_tips_per_person)
+
     async def wait_for_admin(self):
         """
         Phase whilst waiting for confirmation of the admin that he has left the channel.
@@ -179,23 +261,18 @@ class Game:
             self.phase_handler.advance_to_phase(Phase.aborting)
             # await self.abort("")  # TODO: add output message
 
-    @tasks.loop(count=1)
     async def show_word(self):
         """
         Phase to show the word in the corresponding channel.
         Starts Phase.wait_collect_hints
         """
         self.logger_inform_phase()
-        self.word = getword(self.wordpool)  # generate a word
+        if self.announce_embed is None:
+            await self.prepare_word()
         # Show the word:
-        await self.message_sender.send_message(
-            embed=output.announce_word(self.guesser, self.word, closed_game=self.closed_game,
-                                       expected_number_of_tips=self.expected_tips_per_person),
-            key=Key.show_word
-        )
+        await self.message_sender.send_message(embed=self.announce_embed, key=Key.show_word)
         self.phase_handler.advance_to_phase(Phase.wait_collect_hints)
 
-    @tasks.loop(count=1)
     async def wait_collect_hints(self):
         """
         Phase for collecting hints. This method itself only waits for a reaction of the participants via emoji
@@ -211,18 +288,35 @@ class Game:
             self.abort_reason = output.collect_hints_phase_not_ended()
             self.phase_handler.advance_to_phase(Phase.aborting)
         else:
+            await self.show_word_updater.flush()
             self.phase_handler.advance_to_phase(Phase.show_all_hints_to_players)
 
-    @tasks.loop(count=1)
     async def show_all_hints_to_players(self):
         """
         Phase for showing the given hints to the players (but not the guesser) to have them review the tips.
         Prints info message that collecting hints has ended, then prints all given hints, and prints info message
-        asking people to confirm their choices if ready
+        asking people to confirm their choices if ready.
+        In the single review mode of the guild, all of this is one message and hints are vetoed by their number (if
+        there are enough number emojis)
         Starts Phase.wait_for_hints_reviewed
         """
         self.logger_inform_phase()
 
+        review_mode = await get_option(self.channel.guild.id, 'review-mode')
+        if review_mode == 'single' and len(self.hints) <= len(NUMBER_EMOJIS):
+            # Show all hints in one message, that is also the message to confirm that invalid tips have been marked
+            for (hint, emoji) in zip(self.hints, NUMBER_EMOJIS):
+                hint.veto_emoji = emoji
+            review_message = await self.message_sender.send_message(
+                embed=output.hints_to_review(self.hints, check_emoji=CHECK_EMOJI),
+                emoji=NUMBER_EMOJIS[:len(self.hints)] + [CHECK_EMOJI],
+                key=Key.filter_hint_finished
+            )
+            for hint in self.hints:
+                hint.message_id = review_message.id
+            self.phase_handler.advance_to_phase(Phase.wait_for_hints_reviewed)
+            return
+
         # Inform users that hint phase has ended
         await self.message_sender.send_message(
             embed=output.announce_hint_phase_ended(dismiss_emoji=DISMISS_EMOJI),
@@ -230,15 +324,19 @@ class Game:
             group=Group.filter_hint
         )
 
-        # Show all hints with possible reactions
-        for hint in self.hints:
-            hint_message = await self.message_sender.send_message(
+        # Show all hints with possible reactions. The hints are independent of each other, so they are sent
+        # concurrently
+        hint_messages = await fan_out(self.channel.id, [
+            self.message_sender.send_message(
                 embed=output.hint_to_review(hint.hint_message, hint.author),
                 emoji=DISMISS_EMOJI,
                 group=Group.filter_hint
-            )
+            ) for hint in self.hints
+        ])
+        for (hint, hint_message) in zip(self.hints, hint_messages):
             # TODO move keeping track of hint -> message to MessageHandler
             hint.message_id = hint_message.id  # Store the message id in the corresponding hint
+            hint.veto_emoji = DISMISS_EMOJI
 
         # Show message to confirm that invalid tips have been removed
         await self.message_sender.send_message(embed=output.confirm_massage_all_hints_reviewed(),
@@ -246,7 +344,6 @@ class Game:
                                                )
         self.phase_handler.advance_to_phase(Phase.wait_for_hints_reviewed)
 
-    @tasks.loop(count=1)
     async def wait_for_hints_reviewed(self):
         """
         Waits for confirmation that hints have been reviewed.
@@ -261,34 +358,24 @@ class Game:
             self.phase_handler.advance_to_phase(Phase.aborting)
         self.phase_handler.advance_to_phase(Phase.compute_valid_hints)
 
-    @tasks.loop(count=1)
     async def compute_valid_hints(self):
         """
-        Fetches reactions to all printed hints and updates the hints correspondingly, if they have been flagged
+        Looks up the reactions to all printed hints and updates the hints correspondingly, if they have been flagged
         Starts Phase.inform_admin_to_reenter if in admin mode, else Phase.remove_role_from_guesser
         @return: nothing, only used to stop execution
         """
         self.logger_inform_phase()
+        if self.reaction_tally.stale:  # We might have missed reactions while being disconnected
+            await self.reaction_tally.reconcile(self.channel, [hint.message_id for hint in self.hints])
         # Iterate over hints and check if they are valid
         for hint in self.hints:
-            try:
-                message = await self.channel.fetch_message(hint.message_id)
-            except discord.NotFound:
-                if self.aborted:
-                    return  # Program has stopped already, nothing to do
-                else:
-                    print('Fetching hints failed, hint already deleted, aborting')
-                    self.phase_handler.advance_to_phase(Phase.stopping)
-                    return
-            for reaction in message.reactions:
-                if reaction.emoji == DISMISS_EMOJI and reaction.count > 1:
-                    hint.valid = False
+            if self.reaction_tally.count(hint.message_id, hint.veto_emoji) > 0:
+                hint.valid = False
         if self.admin_mode:
             self.phase_handler.advance_to_phase(Phase.inform_admin_to_reenter)
         else:
             self.phase_handler.advance_to_phase(Phase.remove_role_from_guesser)
 
-    @tasks.loop(count=1)
     async def inform_admin_to_reenter(self):
         """
         Deletes all shown hints in the main channel
@@ -297,9 +384,11 @@ class Game:
         Starts Phase.remove_role_from_guesser
         """
         self.logger_inform_phase()
-        # Deleting all shown hints before admin can enter the channel
+        # Deleting all shown hints before admin can enter the channel (in single review mode, the hints are shown in the
+        # confirm message)
         await self.message_sender.message_handler.delete_group(Group.filter_hint)
         await self.message_sender.message_handler.delete_special_message(Key.show_word)
+        await self.message_sender.message_handler.delete_special_message(Key.filter_hint_finished)
         # Inform admin to enter the channel
         if self.admin_channel:
             await self.message_sender.send_message(channel=self.admin_channel,
@@ -309,7 +398,6 @@ class Game:
                                                    )
         self.phase_handler.advance_to_phase(Phase.remove_role_from_guesser)
 
-    @tasks.loop(count=1)
     async def remove_role_from_guesser(self):
         """
         Removes the role from the guesser.
@@ -319,7 +407,6 @@ class Game:
         await self.add_guesser_to_channel()
         self.phase_handler.advance_to_phase(Phase.show_valid_hints)
 
-    @tasks.loop(count=1)
     async def show_valid_hints(self):
         """
         Prints a message showing the valid hints in the main channel
@@ -332,7 +419,6 @@ class Game:
                                                key=Key.show_hints_to_guesser)
         self.phase_handler.advance_to_phase(Phase.wait_for_guess)
 
-    @tasks.loop(count=1)
     async def wait_for_guess(self):
         """
         Waits for the guesser to give a guess. Computes whether game has been won or not
@@ -360,7 +446,6 @@ class Game:
         self.won = evaluate(guess.content, self.word)  # TODO: have better comparing function
         self.phase_handler.advance_to_phase(Phase.show_summary)
 
-    @tasks.loop(count=1)
     async def show_summary(self):
         """
         Prints a pleasing summary of the round containing the word, guess, guesser and all hints (invalid hints are
@@ -368,8 +453,8 @@ class Game:
         Starts the tasks
             wait_for_play_again_in_closed_mode
             wait_for_play_again_in_open_mode
-            wait_for_stop_game_after_timeout
-        (in parallel)
+            warm_up_next_round
+        (in parallel) and registers the timeout that stops the game
         """
         self.logger_inform_phase()
         await self.message_sender.send_message(
@@ -379,20 +464,19 @@ class Game:
         )  # TODO add other emojis?
 
         self.phase_handler.start_task(Phase.wait_for_play_again_in_closed_mode)
-        self.phase_handler.start_task(Phase.wait_for_stop_game_after_timeout)
         self.phase_handler.start_task(Phase.wait_for_play_again_in_open_mode)
+        self.phase_handler.start_task(Phase.warm_up_next_round)
+        logger.info(f'{self.game_prefix()}Game is open for {DEFAULT_TIMEOUT} seconds, closing then')
+        self.stop_timer = wheel.schedule(DEFAULT_TIMEOUT, self.stop_after_timeout)
 
-    @tasks.loop(count=1)
-    async def wait_for_stop_game_after_timeout(self):
+    def stop_after_timeout(self):
         """
-        Takes a timer and stops the game after DEFAULT_TIMEOUT seconds if not cancelled before.
+        Called by the timer wheel DEFAULT_TIMEOUT seconds after the summary, if the timer has not been cancelled before.
         This is to avoid users being locked away from channels if games are not being aborted.
         """
-        logger.info(f'{self.game_prefix()}Game is open for {DEFAULT_TIMEOUT} seconds, closing then')
-        await asyncio.sleep(DEFAULT_TIMEOUT)
-        self.phase_handler.advance_to_phase(Phase.stopping)
+        if self.phase.value < Phase.stopping.value:
+            self.phase_handler.advance_to_phase(Phase.stopping)
 
-    @tasks.loop(count=1)
     async def wait_for_play_again_in_closed_mode(self):
         """
         Waits for a reaction to the summary message. If found (with emoji PLAY_AGAIN_CLOSED_EMOJI), starts a new
@@ -406,11 +490,11 @@ class Game:
                 emoji=PLAY_AGAIN_CLOSED_EMOJI,
                 timeout=0,
         ):
+            next_round = self.take_next_round()
             self.phase_handler.advance_to_phase(Phase.stopping)
-            self.phase_handler.start_task(Phase.play_new_game)
+            self.phase_handler.start_task(Phase.play_new_game, next_round=next_round)
 
     # TODO adjust this function
-    @tasks.loop(count=1)
     async def wait_for_play_again_in_open_mode(self):
         """
         Waits for a reaction to the summary message. If found (with emoji PLAY_AGAIN_OPEN_EMOJI), starts a new
@@ -424,10 +508,66 @@ class Game:
                 emoji=PLAY_AGAIN_OPEN_EMOJI,
                 timeout=0,
         ):
+            next_round = self.take_next_round()
             self.phase_handler.advance_to_phase(Phase.stopping)
-            self.phase_handler.start_task(Phase.play_new_game, closed_mode=False)
+            self.phase_handler.start_task(Phase.play_new_game, closed_mode=False, next_round=next_round)
+
+    async def warm_up_next_round(self):
+        """
+        Background task that prepares the next round while the summary is shown, so that playing again needs as few
+        requests as possible: Draws the word and prepares the lockout of the next guesser.
+        The word is only reserved, stopping() puts it back into the deck if nobody plays again
+        """
+        if not self.participants:
+            return  # There is no next guesser
+        next_round = NextRound(self.participants[0])
+        self.next_round = next_round
+        # Shielded, so that the reservation is completed (and can be put back) even if this task is cancelled
+        next_round.draw = asyncio.ensure_future(reserve_word(self.wordpool))
+        (next_round.word, _) = await asyncio.shield(next_round.draw)
+        if is_immune(next_round.guesser):
+            return  # The guesser waits in the admin channel instead, which is handed over in take_next_round
+        lockout = await make_lockout(self.channel, next_round.guesser)
+        try:
+            await lockout.prepare()
+        except discord.Forbidden:
+            return  # The next round tries again and handles the error
+        next_round.lockout = lockout
+        logger.info(f'{self.game_prefix()}Prepared the next round')
+
+    def take_next_round(self) -> Union[NextRound, None]:
+        """
+        Takes what has been prepared for the next round, together with the admin channel if the next guesser needs one
+        as well. Does not await anything, so that this round can't release the admin channel in the meantime.
+
+        @return: The prepared resources, None if nothing has been prepared
+        """
+        (next_round, self.next_round) = (self.next_round, None)
+        if next_round is None:
+            return None
+        if not self.participants or next_round.guesser != self.participants[0]:
+            next_round.lockout = None  # Prepared for another guesser, only the word can be used
+            return next_round
+        if self.admin_channel and is_immune(next_round.guesser):
+            (next_round.admin_channel, self.admin_channel) = (self.admin_channel, None)
+        return next_round
+
+    async def put_back_next_word(self):
+        """
+        Puts the word drawn for the next round back into the deck if the next round has not been taken, so that no
+        word is skipped
+        """
+        (next_round, self.next_round) = (self.next_round, None)  # Put it back only once if stopping is called twice
+        if next_round is None or next_round.draw is None:
+            return
+        try:
+            (_, position) = await next_round.draw
+            await release_word(self.wordpool, position)
+        except Exception as e:
+            logger.warning(f'{self.game_prefix()}Could not put back the word of the next round: {e}')
+            return
+        logger.info(f'{self.game_prefix()}Put back the word of the next round')
 
-    @tasks.loop(count=1)
     async def clear_messages(self, preserve_keys: List[Key], preserve_groups: List[Group]):
         """
         Background task that clears the messages the current game has sent
@@ -440,12 +580,12 @@ class Game:
             preserve_keys=preserve_keys
         )
 
-    @tasks.loop(count=1)
-    async def play_new_game(self, closed_mode=True):
+    async def play_new_game(self, closed_mode=True, next_round: Union[NextRound, None] = None):
         """
         Starts a new game with the same settings as the current one
 
         @param closed_mode: Whether to run the next game with a participant list (in closed_mode) or not
+        @param next_round: The resources prepared for the new game, see warm_up_next_round
         @return: nothing, only used to end execution
         """
         # Start a new game with the same people
@@ -460,17 +600,17 @@ class Game:
                     participants=self.participants if closed_mode else [],
                     repeation=closed_mode,
                     quick_delete=self.quick_delete, expected_tips_per_person=self.expected_tips_per_person,
+                    next_round=next_round
                     )
-        games.append(game)
+        games.add(game)
         game.play()
 
-    @tasks.loop(count=1)
     async def aborting(self):
         """
         Aborts the current game. This includes adding the guesser back to the channel
         prints an appropriate message why the game has been aborted using attribute self.abort_reason
         """
-        if self.role_given:
+        if self.lockout and self.lockout.locked:
             await self.add_guesser_to_channel()
         await self.message_sender.send_message(
             embed=output.abort(self.abort_reason, self.word, self.guesser),
@@ -479,30 +619,23 @@ class Game:
         )
         self.phase_handler.advance_to_phase(Phase.stopping)  # Stop the game now
 
-    @tasks.loop(count=1)
     async def stopping(self):
         """
-        Stops the current game. This includes deleting all resources, i.e. the admin channel (if exists), the created
-        role. Clears all sent messages (except a known List of exceptions)
+        Stops the current game. Clears all sent messages (except a known List of exceptions) and releases the
+        admin channel (if exists) to the pool of waiting rooms
         """
-        if self.admin_mode:
-            try:
-                if self.admin_channel:  # Admin channel could have been not created yet
-                    try:
-                        await self.admin_channel.delete()
-                    except discord.Forbidden:
-                        logger.fatal(f'{self.game_prefix()}Could not delete the admin channel.')
-                        self.phase_handler.start_task(Phase.fatal_forbidden)
-            except discord.NotFound:
-                logger.warn(f'{self.game_prefix}Admin channel was deleted manually. Please let me do this job!')
-            # Delete admin channel from database
-            if self.admin_channel:
-                dba.del_resource(self.channel.guild.id, value=self.admin_channel.id, resource_type="text_channel")
-            logger.info(f'{self.game_prefix()}Removed admin channel from database')
+        self.show_word_updater.cancel()
+        if self.stop_timer:
+            self.stop_timer.cancel()
         await self.message_sender.message_handler.clear_messages(
             preserve_keys=[Key.summary, Key.abort],
             preserve_groups=[Group.other_bot, Group.user_chat]
         )  # Clearing (almost) everything the bot has sent
+        if self.admin_channel:  # Admin channel could have been not created yet
+            (room, self.admin_channel) = (self.admin_channel, None)  # Release it only once if stopping is called twice
+            await waiting_rooms.release(room)
+            logger.info(f'{self.game_prefix()}Released admin channel')
+        await self.put_back_next_word()
         # We now want to remove reactions from the summary message and edit it to not show the explanations anymore
         # But we don't know if the message was sent, as the game could have stopped earlier. We can check this by
         # checking if a guess is already stored somewhere:
@@ -515,119 +648,66 @@ class Game:
             )
                                                    )
         self.phase = Phase.stopped
-        global games
-        try:
-            games.remove(self)
-        except ValueError:  # Safety feature if stop() is called multiple times (e.g. by abort() and by play())
-            logger.warn(f'{self.game_prefix}Game has already been removed from global variables')
+        if not games.remove(self):  # Safety feature if stop() is called multiple times (e.g. by abort() and by play())
+            logger.warn(f'{self.game_prefix()}Game has already been removed from the game registry')
 
     async def wait_for_reaction_from_user(self, member):
         """
-        Waits for a reaction from a user. If timeout, aborts the current game.
-        @param member: The member of whom one wants to look for a message
+        Waits for the guess of the guesser, delivered by the message router via deliver_guess. If timeout, aborts the
+        current game.
+        @param member: The member of whom one wants to look for a message. Only the guesser is supported
         @return: The message the user has sent.
         """
-
-        def check(message):
-            return message.author == self.guesser and message.channel == self.channel
-
+        if self.guess_future is None:
+            self.guess_future = asyncio.get_event_loop().create_future()
         try:
-            message = await self.bot.wait_for('message', timeout=DEFAULT_TIMEOUT, check=check)
+            message = await wait_for(self.guess_future, timeout=DEFAULT_TIMEOUT)
         except asyncio.TimeoutError:
             self.abort_reason = output.not_guessed()
             self.phase_handler.advance_to_phase(Phase.aborting)
             return None
         return message
 
+    def deliver_guess(self, message: discord.Message):
+        """
+        Hands a message of the guesser to the running wait for the guess. Called by the message router
+        @param message: The message of the guesser
+        """
+        if self.guess_future is None:  # The guess came before we started waiting for it
+            self.guess_future = asyncio.get_event_loop().create_future()
+        if not self.guess_future.done():
+            self.guess_future.set_result(message)
+
     # Helper methods to manage user access to channel
     async def remove_guesser_from_channel(self):
         """
-        Removes the guesser from the current channel by assigning him a role. Manages the permissions of the role and
-        the channel
+        Locks the guesser out of the current channel, using the lockout strategy chosen in the guild
         """
+        if self.lockout is None:  # Not prepared by the previous round
+            self.lockout = await make_lockout(self.channel, self.guesser)
         try:
-            self.role = await self.channel.guild.create_role(name=ROLE_NAME + f": #{self.channel.name}")
-            await self.role.edit(color=ut.orange)
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not create role for this game')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        try:
-            self.guesser_overwrites = self.channel.overwrites_for(self.guesser)
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not read guesser overwrites of the guesser from the current '
-                         f'channel')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        try:
-            await self.channel.set_permissions(self.guesser, read_messages=False)
+            await self.lockout.lock()
         except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not set reading permissions of the guesser in the game channel')
+            logger.fatal(f'{self.game_prefix()}Could not lock the guesser out of the game channel')
             self.phase_handler.start_task(Phase.fatal_forbidden)
-        try:
-            await self.guesser.add_roles(self.role)
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not assign role to guesser.')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        if self.admin_channel:
-            dba.add_resource(self.channel.guild.id, self.role.id)
-        logger.info(f'{self.game_prefix()}Added role to database.')
-        self.role_given = True
+            return
+        logger.info(f'{self.game_prefix()}Locked guesser out using {type(self.lockout).__name__}')
 
     async def make_channel_for_admin(self):
         """
-        Creates a new channel in the same Category as the main channel to have the admin wait there. Configures
-        channel properly.
+        Gets a channel in the same Category as the main channel to have the admin wait there (a pooled one from an
+        earlier round if possible, see waiting_rooms.py)
         """
         self.admin_mode = True  # Mark this game as having admin mode
-        # Create channel for the admin in proper category
-        if self.channel.category:
-            try:
-                self.admin_channel = await self.channel.category.create_text_channel(
-                    name=output.admin_channel_name(self.channel),
-                    reason="Create waiting channel",
-                    overwrites={self.role: discord.PermissionOverwrite(view_channel=True, add_reactions=True)}
-                )
-            except discord.Forbidden:
-                logger.fatal(f'{self.game_prefix()}Could not create admin channel in category properly')
-                self.phase_handler.start_task(Phase.fatal_forbidden)
-        else:
-            try:
-                self.admin_channel = await self.channel.guild.create_text_channel(
-                    name=output.admin_channel_name(self.channel.name),
-                    reason="Create waiting channel",
-                    overwrites={self.role: discord.PermissionOverwrite(view_channel=True, add_reactions=True)}
-                )
-            except discord.Forbidden:
-                logger.fatal(f'{self.game_prefix()}Could not create admin channel in default category properly')
-                self.phase_handler.start_task(Phase.fatal_forbidden)
-
-        # Add channel to created resources so we can delete it even after restart
-        if self.admin_channel:
-            dba.add_resource(self.channel.guild.id, self.admin_channel.id, resource_type="text_channel")
-        logger.info(f'{self.game_prefix()}Added admin channel to database')
-        # Give read access to the bot in the channel
         try:
-            if self.admin_channel:
-                await self.admin_channel.set_permissions(self.channel.guild.me,
-                                                         reason="Bot needs to have write access in the channel",
-                                                         read_messages=True)
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not grant bot read access to admin channel')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        # Hide channel to other users
-        try:
-            if self.admin_channel:
-                await self.admin_channel.set_permissions(self.channel.guild.default_role,
-                                                         reason="Make admin channel only visible to admin himself",
-                                                         read_messages=False)
+            if self.admin_channel:  # Handed over by the previous round
+                self.admin_channel = await waiting_rooms.hand_over(self.admin_channel, self.channel, self.guesser)
+            else:
+                self.admin_channel = await waiting_rooms.acquire(self.channel, self.guesser)
         except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not forbid access to admin channel for @everyone')
+            logger.fatal(f'{self.game_prefix()}Could not create admin channel properly')
             self.phase_handler.start_task(Phase.fatal_forbidden)
 
-        # Show message so that Admin can quickly jump to the channel
-        if self.admin_channel:
-            await self.message_sender.send_message(reaction=False,
-                                                   embed=output.admin_mode_wait(self.guesser, self.admin_channel),
-                                                   key=Key.admin_wait)
         if self.admin_channel:
             await self.message_sender.send_message(
                 embed=output.admin_welcome(self.guesser, emoji=CHECK_EMOJI),
@@ -662,12 +742,7 @@ class Game:
         # Now, add the hint properly
         self.hints.append(Hint(message))
         logger.info(f'{self.game_prefix()}Received a hint')
-        await self.message_sender.edit_message(
-            key=Key.show_word,
-            embed=output.announce_word_updated(self.guesser, self.word, self.hints,
-                                               closed_game=self.closed_game,
-                                               expected_number_of_tips=self.expected_tips_per_person)
-        )  # Update the show_word message to display the person that gave the hint
+        self.show_word_updater.request()  # Update the show_word message to display the person that gave the hint
         print(self.closed_game)
         # In a closed game, check whether everyone has already reacted
         if self.closed_game:
@@ -684,39 +759,26 @@ class Game:
             else:
                 # Skip hint phase as we got every tip already
                 logger.info(f'{self.game_prefix()}Skipping collecting hints as all participants gave enough hints.')
+                await self.show_word_updater.flush()
                 self.phase_handler.advance_to_phase(Phase.show_all_hints_to_players)
 
     async def add_guesser_to_channel(self):
         """
         Adds the guesser back to the main channel
         """
-        guild = await self.bot.fetch_guild(self.channel.guild.id)
-        self.role = guild.get_role(self.role.id)
-        try:
-            await self.guesser.remove_roles(self.role)
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not remove role from guesser.')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        try:
-            await self.role.delete()
-        except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not delete role')
-            self.phase_handler.start_task(Phase.fatal_forbidden)
-        logger.info('Role deleted, user should be back in channel')
-        # re-add user back to channel with overwrites he had before
+        if not self.lockout or not self.lockout.locked:  # E.g. as the guesser is an administrator
+            return
         try:
-            await self.channel.set_permissions(self.guesser, overwrite=self.guesser_overwrites)
+            await self.lockout.unlock()
         except discord.Forbidden:
-            logger.fatal(f'{self.game_prefix()}Could not set guesser overwrites for the current channel')
+            logger.fatal(f'{self.game_prefix()}Could not let the guesser back into the game channel')
+            self.lockout.locked = False  # Do not try again, fatal_forbidden informs about the locked out guesser
             self.phase_handler.start_task(Phase.fatal_forbidden)
-        dba.del_resource(self.channel.guild.id, value=self.role.id)
-        logger.info(f'{self.game_prefix()}Removed role from database')
-        self.role_given = False
+            return
         logger.info(f'{self.game_prefix()}Added user back to channel')
 
-    @tasks.loop(count=1)
     async def fatal_forbidden(self):
-        if self.role_given:
+        if self.lockout and self.lockout.locked:
             await self.add_guesser_to_channel()
         self.phase_handler.cancel_all(cancel_tasks=True)
         await self.channel.send(embed=ut.make_embed(
@@ -725,8 +787,8 @@ class Game:
             value="In case you don't change something with my permissions, this is a permanent error and I won't be "
                   "able to work properly, at least for this channel.\n"
                   "*Also note that the current guesser could be locked out accidentally*,"
-                  "\n a non-deleted role with name "
-                  f"`{ROLE_NAME}: {self.channel.name}` or a channel called "
+                  "\n a role with name "
+                  f"`{ROLE_NAME}: #{self.channel.name}`, a permission overwrite for the guesser or a channel called "
                   f"`{self.channel.name}-warteraum` could still exist that have now to be manually readjusted.",
             footer=f"Please inform the server admins of this issue with game id {self.id}",
             color=ut.red
@@ -739,30 +801,27 @@ class Game:
 
 def find_game(channel: discord.TextChannel = None, user: discord.User = None) -> Union[Game, None]:
     """
-    Finds a game in the global variable of all games running in the channel
+    Finds a game in the registry of all running games
     @param user: The member of whom to search for a game
     @param channel: The channel to be searched in
     @return: The game running in the channel or the game currently played by the member (if any). None otherwise.
     """
-    # Gives back the game running in the current channel, None else
-    global games
-    if games is None:
-        return None
-    for game in games:
-        if (channel and game.channel.id == channel.id) or (user and game.guesser.id == user.id):
-            return game
-    return None
+    return games.find(channel_id=channel.id if channel else None, user_id=user.id if user else None)
 
 
 class PhaseHandler:
     """
         This is a helper class for the Game class. Each Game has a PhaseHandler that handles its phases. As the game is
-        split up in tasks for each phase, each task can tell the phase handler if it has finished, and the phase handler
-        can start the appropriate next phase.
+        split up in coroutines for each phase, each phase can tell the phase handler if it has finished, and the phase
+        handler starts the appropriate next phase.
         The phase handler is there to ensure that no phase is started twice, the phases are started in correct order
         and that parallele running phases are canceled before the start of the next phase (e.g. if we wait for multiple
         possible actions from a user, we start one task for each possible reaction, and the task who finishes first
         informs the PhaseHandler and the PhaseHandler can then cancel the other job)
+        Advancing the phase happens synchronously (the phase is set and the running phase is cancelled), the new phase
+        is then started by a single supervising task per game, that runs one phase at a time in order. Phases that are
+        outdated by the time they would start (because the game has advanced further in the meantime) are skipped.
+        Tasks (phases with a value of at least 1000) run in parallel to the phases as plain asyncio tasks.
         """
 
     def __init__(self, game: Game):
@@ -788,11 +847,15 @@ class PhaseHandler:
 
             Phase.wait_for_play_again_in_closed_mode: game.wait_for_play_again_in_closed_mode,
             Phase.wait_for_play_again_in_open_mode: game.wait_for_play_again_in_open_mode,
-            Phase.wait_for_stop_game_after_timeout: game.wait_for_stop_game_after_timeout,
             Phase.clear_messages: game.clear_messages,
             Phase.play_new_game: game.play_new_game,
-            Phase.fatal_forbidden: game.fatal_forbidden
+            Phase.fatal_forbidden: game.fatal_forbidden,
+            Phase.warm_up_next_round: game.warm_up_next_round
         }
+        self.transitions: asyncio.Queue = asyncio.Queue()  # Phases to start, in order
+        self.supervisor: Union[asyncio.Task, None] = None  # Started with the first phase
+        self.current: Union[asyncio.Task, None] = None  # Task running the current phase
+        self.tasks: Dict[Phase, asyncio.Task] = {}  # Tasks running in parallel to the phases
 
     def cancel_all(self, cancel_tasks=False):
         """
@@ -800,9 +863,12 @@ class PhaseHandler:
         @param cancel_tasks: Whether to cancel the tasks as well
         """
         logger.debug(f'{self.game.game_prefix()}Cancelling all phases{" and tasks" if cancel_tasks else ""}')
-        for phase in self.task_dictionary.keys():
-            if (phase.value < 1000 or cancel_tasks and phase != Phase.fatal_forbidden) and self.task_dictionary[phase]:
-                self.task_dictionary[phase].cancel()
+        if self.current is not None:
+            self.current.cancel()
+        if cancel_tasks:
+            for (phase, task) in self.tasks.items():
+                if phase != Phase.fatal_forbidden:
+                    task.cancel()
         logger.debug(f'{self.game.game_prefix()}Clearing of phases and tasks done.')
 
     def advance_to_phase(self, phase: Phase):
@@ -832,9 +898,27 @@ class PhaseHandler:
             self.game.phase = phase
             self.cancel_all(phase == Phase.stopping)
             if self.task_dictionary[phase]:
-                self.task_dictionary[phase].start()
-            logger.debug(f'{self.game.game_prefix()}Successfully advanced to phase {self.game.phase} and started '
-                         f'corresponding task')
+                self.transitions.put_nowait(phase)
+                if self.supervisor is None:
+                    self.supervisor = asyncio.ensure_future(self.supervise())
+            logger.debug(f'{self.game.game_prefix()}Successfully advanced to phase {self.game.phase}, corresponding '
+                         f'task is scheduled')
+
+    async def supervise(self):
+        """
+        Runs the phases of the game one after the other, until the game has stopped
+        """
+        while self.game.phase != Phase.stopped:
+            phase = await self.transitions.get()
+            if phase != self.game.phase:
+                logger.debug(f'{self.game.game_prefix()}Skipping outdated phase {phase}')
+                continue
+            self.current = asyncio.ensure_future(self.task_dictionary[phase]())
+            await asyncio.wait([self.current])  # Cancelling the phase must not cancel the supervisor
+            if not self.current.cancelled() and self.current.exception() is not None:
+                logger.error(f'{self.game.game_prefix()}Phase {phase} failed', exc_info=self.current.exception())
+            self.current = None
+        logger.debug(f'{self.game.game_prefix()}Game has stopped, supervisor finished')
 
     def start_task(self, phase: Phase, **kwargs):
         """
@@ -844,10 +928,19 @@ class PhaseHandler:
         @param kwargs: Arbitrary list of keyword arguments. This will directly be passed to the called task
         @return: nothing, only used for stopping execution
         """
-        if self.task_dictionary[phase].is_running():
+        task = self.tasks.get(phase)
+        if task is not None and not task.done():
             logger.error(f'{self.game.game_prefix()}Task {phase} is already running, cannot start it twice. '
                          f'Aborting task start.')
             return
         else:
-            self.task_dictionary[phase].start(**kwargs)
+            self.tasks[phase] = asyncio.ensure_future(self.run_task(phase, **kwargs))
             logger.info(f'Started task {phase}')
+
+    async def run_task(self, phase: Phase, **kwargs):
+        try:
+            await self.task_dictionary[phase](**kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'{self.game.game_prefix()}Task {phase} failed', exc_info=e)
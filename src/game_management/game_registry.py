@@ -0,0 +1,81 @@
+from typing import Dict, Iterator, TYPE_CHECKING, Union
+
+from log_setup import logger
+
+if TYPE_CHECKING:
+    from game_management.game import Game
+
+
+class GameRegistry:
+    """
+    Registry of all running games, indexed by game id, channel id and guesser id so that looking up the game of
+    a channel or a guesser is a single dictionary access.
+    Adding and removing games never awaits anything, so the indexes are always consistent with each other.
+    Only games that are still present in an index are removed from it: If a new game has already been registered in
+    the channel of a stopping game, removing the old game leaves the new one untouched.
+    """
+    def __init__(self):
+        self.games: Dict[int, 'Game'] = {}  # Indexed by game id
+        self.channels: Dict[int, 'Game'] = {}  # Indexed by channel id
+        self.guessers: Dict[int, 'Game'] = {}  # Indexed by guesser id
+        self.guild_counts: Dict[int, int] = {}  # Number of registered games per guild
+
+    def add(self, game: 'Game'):
+        """
+        Registers a game
+
+        @param game: The game to register. Replaces games registered for the same channel or guesser in the indexes
+        """
+        if game.id in self.games:
+            logger.warn(f'{game.game_prefix()}Game is already registered, ignoring it.')
+            return
+        self.games[game.id] = game
+        self.channels[game.channel.id] = game
+        self.guessers[game.guesser.id] = game
+        guild_id = game.channel.guild.id
+        self.guild_counts[guild_id] = self.guild_counts.get(guild_id, 0) + 1
+
+    def remove(self, game: 'Game') -> bool:
+        """
+        Removes a game from the registry
+
+        @param game: The game to remove
+        @return: Whether the game was registered
+        """
+        if self.games.pop(game.id, None) is None:
+            return False
+        if self.channels.get(game.channel.id) is game:
+            del self.channels[game.channel.id]
+        if self.guessers.get(game.guesser.id) is game:
+            del self.guessers[game.guesser.id]
+        guild_id = game.channel.guild.id
+        self.guild_counts[guild_id] -= 1
+        if self.guild_counts[guild_id] == 0:
+            del self.guild_counts[guild_id]
+        return True
+
+    def find(self, channel_id: Union[int, None] = None, user_id: Union[int, None] = None) -> Union['Game', None]:
+        """
+        @param channel_id: The channel to search a game in
+        @param user_id: The guesser to search a game of
+        @return: The game running in the channel, else the game guessed by the user (if any). None otherwise.
+        """
+        game = self.channels.get(channel_id)
+        if game is None and user_id is not None:
+            game = self.guessers.get(user_id)
+        return game
+
+    def counts_per_guild(self) -> Dict[int, int]:
+        """
+        @return: A copy of the number of registered games per guild id
+        """
+        return dict(self.guild_counts)
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self) -> Iterator['Game']:
+        return iter(list(self.games.values()))
+
+    def __contains__(self, game: 'Game'):
+        return self.games.get(game.id) is game
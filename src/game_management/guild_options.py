@@ -0,0 +1,44 @@
+from typing import Dict, Tuple, Union
+
+import database.db_access as dba
+
+"""
+This file caches simple options of the guilds, i.e. settings that have at most one value per guild (e.g. the review
+mode). They are read from the database once and served from memory afterwards. Change them only with set_option, so
+that the cache stays valid.
+"""
+
+options: Dict[Tuple[int, str], Union[str, None]] = {}  # Indexed by guild id and name of the setting
+
+
+async def get_option(guild_id: int, setting: str, default: Union[str, None] = None) -> Union[str, None]:
+    """
+    @param guild_id: The guild to get the option of
+    @param setting: The name of the setting
+    @param default: Returned if the option is not set
+    @return: The value of the option in the guild, or default if it is not set
+    """
+    key = (guild_id, setting)
+    if key not in options:
+        entries = await dba.get_settings_for(guild_id, setting=setting)
+        options[key] = entries[0].value if entries else None
+    value = options[key]
+    return default if value is None else value
+
+
+async def set_option(guild_id: int, setting: str, value: Union[str, None], set_by=0):
+    """
+    Sets an option of a guild in the database and the cache
+
+    @param guild_id: The guild to set the option for
+    @param setting: The name of the setting
+    @param value: The new value. None removes the option, so that the default applies again
+    @param set_by: id of the member that set the option
+    """
+    if value is None:
+        entries = await dba.get_settings_for(guild_id, setting=setting)
+        for entry in entries or []:
+            await dba.del_setting(guild_id, entry.value, setting=setting)
+    else:
+        await dba.replace_setting(guild_id, value, setting=setting, set_by=set_by)
+    options[(guild_id, setting)] = value
@@ -0,0 +1,235 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Type, Union
+
+import discord
+
+import database.db_access as dba
+import utils as ut
+from database.resource_journal import journal as resource_journal
+from environment import ROLE_NAME
+from game_management.guild_options import get_option
+from log_setup import logger
+
+"""
+This file contains the strategies to lock the guesser out of the game channel while the others give their hints.
+Every strategy needs one REST call to lock the guesser out and one to let them back in (the reusable role strategy
+needs two more, once per channel, to create its role).
+The strategy is chosen per guild (option 'lockout', see the lockout command in cogs/settings.py).
+A strategy raises discord.Forbidden if the bot lacks the permissions to lock or unlock.
+"""
+
+Target = Union[discord.Role, discord.Member]
+
+
+def can_read(channel: discord.TextChannel, member: discord.Member, roles: Iterable[discord.Role] = (),
+             overwrites: Union[Dict[Target, discord.PermissionOverwrite], None] = None) -> bool:
+    """
+    Computes whether a member can read a channel the way Discord does (base permissions of the roles, then the
+    overwrites of @everyone, of the roles and of the member). The cache is only updated once the gateway reports a
+    change, so the changes a lockout has just made are passed explicitly
+
+    @param channel: The channel to check
+    @param member: The member to check
+    @param roles: Roles the member has in addition to the cached ones
+    @param overwrites: Overwrites of the channel that replace the cached ones
+    @return: Whether the member can read the channel
+    """
+    if is_immune(member):
+        return True
+    overwrites = overwrites or {}
+
+    def overwrite_for(target: Target) -> Union[bool, None]:
+        return overwrites.get(target, channel.overwrites_for(target)).read_messages
+
+    default_role = channel.guild.default_role
+    roles = list(member.roles) + [role for role in roles if role not in member.roles]
+    readable = any(role.permissions.read_messages for role in roles)
+    if overwrite_for(default_role) is not None:
+        readable = overwrite_for(default_role)
+    role_values = {overwrite_for(role) for role in roles if role != default_role}
+    if False in role_values:  # Denies of the roles are applied first, any allow of a role wins over them
+        readable = False
+    if True in role_values:
+        readable = True
+    if overwrite_for(member) is not None:
+        readable = overwrite_for(member)
+    return readable
+
+
+class LockoutStrategy(ABC):
+    """
+    Locks one guesser out of one channel. Create a new instance for each round
+    """
+    def __init__(self, channel: discord.TextChannel, guesser: discord.Member):
+        self.channel = channel
+        self.guesser = guesser
+        self.locked = False  # Whether the guesser is locked out right now
+
+    async def prepare(self):
+        """
+        Does the work that is possible before the guesser is locked out, so that locking them out is quicker.
+        Called while the summary of the previous round is shown
+        """
+        pass
+
+    @abstractmethod
+    async def lock(self):
+        """
+        Hides the channel from the guesser
+        """
+
+    @abstractmethod
+    async def unlock(self):
+        """
+        Shows the channel to the guesser again, restoring their previous permissions
+        """
+
+    @abstractmethod
+    def hides_channel(self) -> bool:
+        """
+        @return: Whether the guesser can't read the channel anymore with the changes of the lockout. Check this after
+                locking, other permissions of the guesser (e.g. an allow of another role) can defeat a lockout
+        """
+
+
+class OverwriteLockout(LockoutStrategy):
+    """
+    Locks the guesser out with a permission overwrite for them in the channel. The overwrite they had before is restored
+    when unlocking
+    """
+    def __init__(self, channel: discord.TextChannel, guesser: discord.Member):
+        super().__init__(channel, guesser)
+        self.previous_overwrite: Union[discord.PermissionOverwrite, None] = None
+        self.overwrite: Union[discord.PermissionOverwrite, None] = None  # Set by lock
+
+    async def lock(self):
+        self.previous_overwrite = self.channel.overwrites_for(self.guesser)  # From the cache, no request needed
+        overwrite = discord.PermissionOverwrite.from_pair(*self.previous_overwrite.pair())
+        overwrite.read_messages = False
+        await self.channel.set_permissions(self.guesser, overwrite=overwrite, reason="Lock out the guesser")
+        self.overwrite = overwrite
+        self.locked = True
+
+    async def unlock(self):
+        # An empty overwrite is removed instead of being left behind in the channel
+        previous = None if self.previous_overwrite is None or self.previous_overwrite.is_empty() \
+            else self.previous_overwrite
+        await self.channel.set_permissions(self.guesser, overwrite=previous, reason="Let the guesser back in")
+        self.locked = False
+
+    def hides_channel(self) -> bool:
+        return self.locked and not can_read(self.channel, self.guesser, overwrites={self.guesser: self.overwrite})
+
+
+class ReusableRoleLockout(LockoutStrategy):
+    """
+    Locks the guesser out by giving them a role that cannot read the channel. There is one such role per channel. It is
+    created for the first round in the channel and then kept (and recorded as resource of type 'guesser_role'), so
+    that later rounds only add and remove the role.
+    If the role does not hide the channel (e.g. as another role of the guesser allows reading it), an overwrite for the
+    guesser is used instead.
+    """
+    roles: Dict[int, int] = {}  # id of the role, indexed by channel id
+
+    def __init__(self, channel: discord.TextChannel, guesser: discord.Member):
+        super().__init__(channel, guesser)
+        self.role: Union[discord.Role, None] = None
+        # Overwrite of the role this lockout has set in the channel itself, the cache only knows it once the gateway
+        # reports it
+        self.role_overwrite: Union[discord.PermissionOverwrite, None] = None
+        self.fallback: Union[OverwriteLockout, None] = None
+
+    async def prepare(self):
+        self.role = await self.channel_role()
+
+    async def lock(self):
+        if self.role is None:  # Not prepared
+            self.role = await self.channel_role()
+        await self.deny_role()
+        # The cache does not know about the role before the gateway reports it, so check what adding it will change
+        if self.role_hides_channel():
+            await self.guesser.add_roles(self.role, reason="Lock out the guesser")
+        else:
+            logger.info(f'[Lockout] [Channel {self.channel.id}] The role does not hide the channel from the guesser, '
+                        f'using an overwrite instead')
+            self.fallback = OverwriteLockout(self.channel, self.guesser)
+            await self.fallback.lock()
+        self.locked = True
+
+    async def deny_role(self):
+        """
+        Sets the overwrite of the role again if it does not deny reading the channel anymore, e.g. as a moderator
+        removed it
+        """
+        if self.role_overwrite is not None:  # Set by this lockout already
+            return
+        overwrite = self.channel.overwrites_for(self.role)
+        if overwrite.read_messages is False:
+            return
+        overwrite.read_messages = False
+        await self.channel.set_permissions(self.role, overwrite=overwrite, reason="Role to lock out the guesser")
+        self.role_overwrite = overwrite
+        logger.info(f'[Lockout] [Channel {self.channel.id}] Restored the overwrite of role {self.role.id}')
+
+    def role_hides_channel(self) -> bool:
+        overwrites = {self.role: self.role_overwrite} if self.role_overwrite is not None else None
+        return not can_read(self.channel, self.guesser, roles=[self.role], overwrites=overwrites)
+
+    def hides_channel(self) -> bool:
+        if self.fallback:
+            return self.fallback.hides_channel()
+        return self.locked and self.role_hides_channel()
+
+    async def unlock(self):
+        if self.fallback:
+            await self.fallback.unlock()
+        else:
+            await self.guesser.remove_roles(self.role, reason="Let the guesser back in")
+        self.locked = False
+
+    async def channel_role(self) -> discord.Role:
+        """
+        @return: The role of the channel, it is looked up in the overwrites of the channel or created if there is none
+        """
+        guild = self.channel.guild
+        role = guild.get_role(self.roles.get(self.channel.id, 0))
+        if role is None:  # Not known yet, e.g. after a restart
+            recorded = {entry.value for entry in await dba.get_resources_for(guild.id, resource_type='guesser_role')
+                        or []}
+            role = next((target for target in self.channel.overwrites
+                         if isinstance(target, discord.Role) and target.id in recorded), None)
+        if role is None:
+            role = await guild.create_role(name=f'{ROLE_NAME}: #{self.channel.name}', color=ut.orange,
+                                           reason="Role to lock out the guesser")
+            resource_journal.add(guild.id, role.id, resource_type='guesser_role')
+            overwrite = discord.PermissionOverwrite(read_messages=False)
+            await self.channel.set_permissions(role, overwrite=overwrite, reason="Role to lock out the guesser")
+            self.role_overwrite = overwrite
+            logger.info(f'[Lockout] [Channel {self.channel.id}] Created role {role.id} to lock out guessers')
+        self.roles[self.channel.id] = role.id
+        return role
+
+
+def is_immune(member: discord.Member) -> bool:
+    """
+    @param member: The member to check
+    @return: Whether the member can't be locked out of channels, as they are an administrator or the owner of the guild
+    """
+    return member.guild_permissions.administrator or member.id == member.guild.owner_id
+
+
+strategies: Dict[str, Type[LockoutStrategy]] = {
+    'overwrite': OverwriteLockout,
+    'role': ReusableRoleLockout,
+}
+DEFAULT_LOCKOUT = 'overwrite'
+
+
+async def make_lockout(channel: discord.TextChannel, guesser: discord.Member) -> LockoutStrategy:
+    """
+    @param channel: The channel of the game
+    @param guesser: The guesser to lock out
+    @return: A lockout of the strategy chosen in the guild of the channel
+    """
+    name = await get_option(channel.guild.id, 'lockout', default=DEFAULT_LOCKOUT)
+    return strategies.get(name, strategies[DEFAULT_LOCKOUT])(channel, guesser)
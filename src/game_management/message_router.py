@@ -0,0 +1,95 @@
+from typing import Awaitable, Callable, Dict
+
+import discord
+from discord.ext import commands
+
+import game_management.output as output
+from environment import PREFIX
+from game_management.game import Game, games
+from game_management.tools import Group, Phase
+from log_setup import logger
+
+"""
+This file routes all incoming messages: Commands are passed to the bot, messages in channels with a running game are
+passed to the game depending on its phase (as hints, as the guess or as chat).
+A message in a channel without a game costs only one dictionary lookup before it is passed to the bot.
+"""
+
+WHILE_IN_GAME_COMMANDS = [f'{PREFIX}abort']  # Commands that can be used before a game has shown its summary
+
+
+def on_message_prefix(message: discord.Message):
+    return f'[Message Router] [Message {message.id}] '
+
+
+class MessageRouter:
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # Handlers for messages of users (not commands) in a game channel, indexed by the phase of the game
+        self.phase_handlers: Dict[Phase, Callable[[Game, discord.Message], Awaitable[None]]] = {
+            Phase.wait_collect_hints: self.route_hint,
+            Phase.wait_for_guess: self.route_guess,
+        }
+
+    async def route(self, message: discord.Message):
+        """
+        Routes an incoming message, called by the on_message event of the bot
+
+        @param message: The message to route
+        """
+        game = games.channels.get(message.channel.id)
+        if game is None:
+            await self.bot.process_commands(message)
+            return
+
+        if message.author.bot:
+            if message.author.id != self.bot.user.id:
+                game.message_sender.message_handler.add_message_to_group(message, Group.other_bot)
+                logger.debug(f'{on_message_prefix(message)}Message was written by other bot, added it to group '
+                             f'{Group.other_bot} of the running game {game.id}')
+            return
+
+        if message.content.startswith(PREFIX):
+            await self.route_command(game, message)
+            return
+
+        handler = self.phase_handlers.get(game.phase, self.route_chat)
+        await handler(game, message)
+
+    async def route_command(self, game: Game, message: discord.Message):
+        """
+        Commands in a game channel are only executed once the game has shown its summary (except for some commands
+        that are needed while the game is running)
+        """
+        game.message_sender.message_handler.add_message_to_group(message, Group.own_command_invocation)
+        logger.debug(f'{on_message_prefix(message)}Message is a command for myself, added it to group '
+                     f'{Group.own_command_invocation} of game {game.id}')
+        if game.phase.value >= Phase.show_summary.value \
+                or any(message.content.startswith(command) for command in WHILE_IN_GAME_COMMANDS):
+            await self.bot.process_commands(message)
+        else:
+            await game.message_sender.send_message(embed=output.game_running_warning(), reaction=False,
+                                                   group=Group.warn)
+
+    @staticmethod
+    async def route_hint(game: Game, message: discord.Message):
+        # Check if we have to delete the message
+        if not game.closed_game or message.author in game.participants:
+            await message.delete()
+            logger.debug(f'{on_message_prefix(message)}Message was deleted as it will be processed as a hint by '
+                         f'the game')
+        await game.add_hint(message)
+
+    async def route_guess(self, game: Game, message: discord.Message):
+        #  Check if message is from the guesser, if not, it is regular chat
+        if message.author.id == game.guesser.id:
+            logger.debug(f'{on_message_prefix(message)}Message is the guess of the game {game.id}')
+            game.deliver_guess(message)
+        else:
+            await self.route_chat(game, message)
+
+    @staticmethod
+    async def route_chat(game: Game, message: discord.Message):
+        game.message_sender.message_handler.add_message_to_group(message, group=Group.user_chat)
+        logger.debug(f'{on_message_prefix(message)}Message was added to group {Group.user_chat} of the game, '
+                     f'as it is not a hint or the guess for the game.')
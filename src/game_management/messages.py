@@ -1,15 +1,67 @@
 import asyncio
-from typing import List, Union
+import datetime
+import weakref
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Union
 
 import discord
 import discord.ext
 
 import game_management.output as output
 from environment import CHECK_EMOJI, SKIP_EMOJI, DEFAULT_TIMEOUT
+from game_management.reaction_dispatcher import dispatcher
 from game_management.tools import Key, Group
 from log_setup import logger
 
 
+BULK_DELETE_LIMIT = 100  # Maximal number of messages deleted by one bulk delete
+# Discord only bulk deletes messages younger than 14 days, keep a margin for the time the request takes
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+Handle = Union[discord.Message, discord.PartialMessage]  # Message that can be edited and deleted without fetching it
+
+CHANNEL_CONCURRENCY = 5  # Maximal number of concurrent API calls per channel, Discord allows 5 messages per 5 seconds
+
+_channel_semaphores: 'weakref.WeakValueDictionary[int, asyncio.Semaphore]' = weakref.WeakValueDictionary()
+
+
+async def gather_all(*calls: Awaitable) -> list:
+    """
+    Like asyncio.gather, but always waits for all calls to finish before raising the first exception, so that no call
+    keeps running in the background unnoticed
+
+    @param calls: The awaitables to run concurrently
+    @return: The results of the calls, in the order of the calls
+    """
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def fan_out(channel_id: int, calls: Iterable[Awaitable]) -> list:
+    """
+    Runs independent API calls concerning one channel concurrently. At most CHANNEL_CONCURRENCY calls per channel run
+    at the same time (across all fan-outs), discord.py itself handles the rate limits beyond that.
+    The calls finish in arbitrary order, so only fan out calls whose order does not matter. Everything awaited after
+    the fan-out happens after all of the calls.
+
+    @param channel_id: The channel the calls concern
+    @param calls: The awaitables (e.g. coroutines) to run
+    @return: The results of the calls, in the order of the calls
+    """
+    semaphore = _channel_semaphores.get(channel_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+        _channel_semaphores[channel_id] = semaphore
+
+    async def limited(call: Awaitable):
+        async with semaphore:
+            return await call
+
+    return await gather_all(*(limited(call) for call in calls))
+
+
 def message_handler_prefix():
     return '[Message Handler] '
 
@@ -21,8 +73,10 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
     def __init__(self, guild: discord.Guild, default_channel: discord.TextChannel):
         self.guild: discord.Guild = guild
         self.default_channel: discord.TextChannel = default_channel
-        self.special_messages = {}  # Stores some special messages with keywords
-        self.group_messages = {}  # Stores groups of messages by their group names
+        # Messages are stored as the handles returned when sending them (or partial messages), so that they can be
+        # edited and deleted without fetching them first
+        self.special_messages: Dict[Key, Handle] = {}  # Stores some special messages with keywords
+        self.group_messages: Dict[Group, List[Handle]] = {}  # Stores groups of messages by their group names
         logger.debug(f'{message_handler_prefix()}New message handler at guild {guild.id} with default channel '
                      f'{default_channel.id}')
         # Useful if we don't need to differentiate between a set of messages
@@ -38,9 +92,9 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
         logger.debug(f'{message_handler_prefix()}Adding message with id {message.id} to '
                      f'Group {group}')
         try:
-            self.group_messages[group].append((message.channel.id, message.id))
+            self.group_messages[group].append(message)
         except KeyError:
-            self.group_messages[group] = [(message.channel.id, message.id)]
+            self.group_messages[group] = [message]
 
     def add_special_message(self, message: discord.Message, key: Key):
         """
@@ -55,7 +109,7 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
         if key in self.special_messages:
             logger.error(f'{message_handler_prefix()}Tried to add a message with key {key}, but key is already used')
         else:
-            self.special_messages[key] = (message.channel.id, message.id)
+            self.special_messages[key] = message
             logger.debug(f'{message_handler_prefix()}Successfully added message with id {message.id} into key {key}')
 
     async def delete_group(self, group: Group = Group.default):
@@ -75,52 +129,78 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
             logger.debug(f'{message_handler_prefix()}Group {group} is empty list, nothing to delete here.')
             return
         logger.debug(f'{message_handler_prefix()}Deleting non-empty group {group}')
-        for (channel_id, message_id) in to_delete:
-            message = await self._fetch_message_from_channel(channel_id=channel_id, message_id=message_id)
-            if message:
-                await message.delete()
+        await self._delete_messages(to_delete)
 
-    async def _fetch_message_from_channel(self, channel_id, message_id) -> Union[discord.Message, None]:
+    async def _delete_messages(self, messages: List[Handle]):
         """
-        Fetches a message from a channel
+        Deletes messages without fetching them. The messages are grouped by their channel and deleted with as few bulk
+        deletes as possible. Messages that are too old for bulk deletion (or alone in their channel) are deleted
+        one by one.
 
-        @param channel_id: The channel id to get the message from
-        @param message_id: The id of the message to be fetched
-        @return: The message (if exists), None otherwise
+        @param messages: The messages to delete
+        @return: nothing
         """
-        logger.debug(f'{message_handler_prefix()}Trying to fetch message from channel id {channel_id}'
-                     f' with id {message_id}')
-        channel: discord.TextChannel = self.guild.get_channel(channel_id=channel_id)
+        by_channel: Dict[int, List[Handle]] = {}
+        for message in messages:
+            by_channel.setdefault(message.channel.id, []).append(message)
+        # Channels have independent rate limits, so they are cleared concurrently
+        await gather_all(*(self._delete_messages_in_channel(channel_id, channel_messages)
+                           for (channel_id, channel_messages) in by_channel.items()))
+
+    async def _delete_messages_in_channel(self, channel_id: int, messages: List[Handle]):
+        """
+        Deletes messages of one channel, see _delete_messages
+
+        @param channel_id: The channel the messages are in
+        @param messages: The messages to delete
+        @return: nothing
+        """
+        channel: discord.TextChannel = self.guild.get_channel(channel_id)
         if channel is None:
             logger.warn(f'{message_handler_prefix()}Channel with id {channel_id} does not exist anymore.')
-            return None
+            return
+        oldest_bulk = datetime.datetime.utcnow() - BULK_DELETE_MAX_AGE
+        recent = [message for message in messages if message.created_at > oldest_bulk]
+        single = [message for message in messages if message.created_at <= oldest_bulk]
+        for start in range(0, len(recent), BULK_DELETE_LIMIT):
+            chunk = recent[start:start + BULK_DELETE_LIMIT]
+            if len(chunk) == 1:
+                single += chunk
+                continue
+            try:
+                await channel.delete_messages(chunk)
+                logger.debug(f'{message_handler_prefix()}Bulk deleted {len(chunk)} messages in channel {channel_id}')
+            except discord.HTTPException as e:
+                logger.warn(f'{message_handler_prefix()}Bulk delete in channel {channel_id} failed, deleting '
+                            f'the messages one by one: {e}')
+                single += chunk
+        await fan_out(channel_id, [self._delete_message(message) for message in single])
+
+    @staticmethod
+    async def _delete_message(message: Handle):
         try:
-            message = await channel.fetch_message(message_id)  # Getting message. Throws error, if not existing
-            logger.debug(f'Returning message in channel {channel.name} with id {message_id}')
-            return message
+            await message.delete()
         except discord.NotFound:
-            logger.warn(f'{message_handler_prefix()}Message with id {message_id} not found in channel {channel_id}')
-            return None
+            logger.warn(f'{message_handler_prefix()}Message with id {message.id} not found in channel '
+                        f'{message.channel.id}')
 
-    async def get_special_message(self, key: Key) -> Union[discord.Message, None]:
+    async def get_special_message(self, key: Key) -> Union[Handle, None]:
         """
-        Fetch a message that was previously indexed by a key
+        Get a message that was previously indexed by a key
 
         @param key: Key the message has been indexed before
         @return: The message (if exists), None otherwise
         """
         logger.debug(f'{message_handler_prefix()}Trying to get special message with key {key}')
         try:
-            entry = self.special_messages[key]
+            message = self.special_messages[key]
         except KeyError:
             logger.error(f'{message_handler_prefix()}Special message with key {key} has never been indexed.')
             return None
-        if entry is None:
+        if message is None:
             logger.error(f'{message_handler_prefix()}No entry for key {key} in the database, nothing to fetch.')
             return None
-        (channel_id, message_id) = entry
-        message = await self._fetch_message_from_channel(channel_id, message_id)  # Proper error handling is done here
-        return message  # Could be None if message did not exist
+        return message
 
     async def delete_special_message(self, key: Key, pop=True):
         """
@@ -131,12 +211,12 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
         @return: nothing
         """
         logger.debug(f'{message_handler_prefix()}Trying to delete special message wih key {key}')
-        message: discord.Message = await self.get_special_message(key)
+        message = await self.get_special_message(key)
         if message is None:
             logger.warn(f'{message_handler_prefix()}Message with key {key} not found, nothing to delete here.')
             return
         else:
-            await message.delete()
+            await self._delete_message(message)
             logger.debug(f'{message_handler_prefix()}Deleting message with id {message.id}')
         if pop:
             self.special_messages.pop(key)
@@ -152,18 +232,88 @@ class MessageHandler:  # Basic message handler for messages that one wants to se
         """
         logger.debug(f'{preserve_keys}Clearing messages except keys {preserve_keys} and groups {preserve_groups}')
 
+        to_delete = []
         special_message_keys = [special_message_key for special_message_key in self.special_messages.keys()]
         for special_message_key in special_message_keys:
             logger.debug(f"{message_handler_prefix()}Checking key {special_message_key} within preserving list"
                          f" {preserve_keys}")
             if special_message_key not in preserve_keys:
-                await self.delete_special_message(special_message_key, pop=True)
+                to_delete.append(self.special_messages.pop(special_message_key))
 
         for group_key in self.group_messages.keys():
             logger.debug(f'{message_handler_prefix()}Checking group {group_key} within preserving list'
                          f' {preserve_groups}')
             if group_key not in preserve_groups:
-                await self.delete_group(group_key)
+                to_delete += self.group_messages[group_key]
+                self.group_messages[group_key] = []
+        # All messages at once, so that messages of different groups in the same channel share bulk deletes
+        await self._delete_messages(to_delete)
+
+
+class CoalescedEdit:
+    """
+    Coalesces frequent edits of a special message: Edits are requested instead of being done immediately, and at most
+    one edit per interval is done, showing the latest state. If the state did not change since the last edit (or since
+    the message has been sent), the edit is skipped.
+    """
+    def __init__(self, message_sender: 'MessageSender', key: Key, render: Callable[[], discord.Embed],
+                 state: Callable[[], Hashable], interval: float):
+        """
+        @param message_sender: The message sender that sent the message
+        @param key: The key of the message to edit
+        @param render: Function computing the new embed of the message. Only called if the message is edited
+        @param state: Function computing the state the message shows, two equal states have the same embed
+        @param interval: Minimal number of seconds between two edits
+        """
+        self.message_sender = message_sender
+        self.key = key
+        self.render = render
+        self.state = state
+        self.interval = interval
+        self.shown_state = state()  # State shown by the message
+        self.last_edit = float('-inf')  # Event loop time of the last edit
+        self.handle: Union[asyncio.TimerHandle, None] = None  # Scheduled edit
+        self.task: Union[asyncio.Task, None] = None  # Running scheduled edit
+        self.lock = asyncio.Lock()  # Edits happen one after the other
+
+    def request(self):
+        """
+        Requests an edit of the message. It is done once the interval since the last edit has passed
+        """
+        if self.handle is not None:
+            return  # The scheduled edit will show the latest state anyways
+        loop = asyncio.get_event_loop()
+        delay = max(0.0, self.last_edit + self.interval - loop.time())
+        self.handle = loop.call_later(delay, self._run_scheduled)
+
+    def _run_scheduled(self):
+        self.handle = None
+        self.task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Edits the message now if its state has changed, e.g. before the next phase of the game relies on it
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        async with self.lock:
+            state = self.state()
+            if state == self.shown_state:
+                return
+            self.shown_state = state
+            self.last_edit = asyncio.get_event_loop().time()
+            await self.message_sender.edit_message(key=self.key, embed=self.render())
+
+    def cancel(self):
+        """
+        Cancels a scheduled edit, e.g. because the message is about to be deleted
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.task is not None and not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
 
 
 class MessageSender:
@@ -199,6 +349,7 @@ class MessageSender:
         else:
             message = await self.default_channel.send(normal_text, embed=embed)
         if reaction:  # Only add reaction if prompted to do so
+            # Reactions are added one after the other, they are displayed in the order they were added
             if type(emoji) is list:
                 for e in emoji:
                     await message.add_reaction(e)
@@ -222,16 +373,19 @@ class MessageSender:
         message = await self.message_handler.get_special_message(key)
         if message is None:
             return
-        if embed is None:
-            if normal_text != "":
-                await message.edit(normal_text=normal_text)
-            else:
-                print('Nothing to be edited')
-        else:
-            if normal_text != "":
-                await message.edit(normal_text=normal_text, embed=embed)
+        try:
+            if embed is None:
+                if normal_text != "":
+                    await message.edit(content=normal_text)
+                else:
+                    print('Nothing to be edited')
             else:
-                await message.edit(embed=embed)
+                if normal_text != "":
+                    await message.edit(content=normal_text, embed=embed)
+                else:
+                    await message.edit(embed=embed)
+        except discord.NotFound:
+            logger.warn(f'{self.message_sender_prefix()}Message with key {key} not found, nothing to edit here.')
 
     async def clear_reactions(self, key: Key):
         """
@@ -242,7 +396,7 @@ class MessageSender:
         message = await self.message_handler.get_special_message(key)
         try:
             await message.clear_reactions()
-        except AttributeError:
+        except (AttributeError, discord.NotFound):
             print('Failed to clear reactions')
 
     async def wait_for_reaction_to_message(self,
@@ -257,7 +411,7 @@ class MessageSender:
         """
         Method that waits for a reaction to a message while informing the user with proper warnings
 
-        :param bot: The bot that waits for the reaction
+        :param bot: The bot that waits for the reaction, used to look up whether users are bots
         :param message_key: Key of the message that one wants to observe
         :param emoji: The reaction emoji one wants to wait for
         :param member: [Optional] the member or members of whom one wants to wait for a reaction
@@ -269,27 +423,25 @@ class MessageSender:
         """
 
         message = await self.message_handler.get_special_message(key=message_key)
+        if message is None:
+            return False
+        member_ids = None
+        if member:
+            member_ids = {person.id for person in member} if type(member) == list else {member.id}
 
-        def check(reaction, user):
-            #  Only respond to reactions from non-bots with the correct emoji
+        def check(payload: discord.RawReactionActionEvent):
+            #  Only respond to reactions from non-bots (the emoji and message are already matched by the dispatcher)
             #  Optionally check if the user is the given member
             logger.debug(f'{self.message_sender_prefix()}Found a reaction, checking if valid...')
-            if member:
-                # print(f'User that reacted has id {user}, reacted with {str(reaction.emoji)} to message with id' f'{
-                # reaction.message.id}, while i wait for a reaction of {member.id} with {str(emoji)} to message with
-                # id' f' {message.id}')
-                if type(member) != list:
-                    return user.id == member.id and str(reaction.emoji) == emoji and reaction.message == message
-                else:
-                    return user.id in [person.id for person in member] and str(
-                        reaction.emoji) == emoji and reaction.message == message
-            else:
-                return (not user.bot or react_to_bot) and str(reaction.emoji) == emoji and reaction.message == message
+            if member_ids:
+                return payload.user_id in member_ids
+            user = payload.member or bot.get_user(payload.user_id)
+            return react_to_bot or user is None or not user.bot
 
         logger.debug(f'{self.message_sender_prefix()}'
                      f'Waiting for reaction to message with key {message_key}{f" by {member.name}" if member else ""}')
         try:
-            reaction, user = await bot.wait_for('reaction_add', timeout=warning_time, check=check)
+            await dispatcher.wait_for(message.id, emoji, check=check, timeout=warning_time)
             logger.debug(f'{self.message_sender_prefix()}...reaction valid, returning True')
             return True  # Notify that reaction was found
         except asyncio.TimeoutError:
@@ -307,7 +459,7 @@ class MessageSender:
             # Try a second time
             logger.debug(f'{self.message_sender_prefix()}Trying to wait a second time')
             try:
-                reaction, user = await bot.wait_for('reaction_add', timeout=timeout, check=check)
+                await dispatcher.wait_for(message.id, emoji, check=check, timeout=timeout)
                 logger.debug(f'{self.message_sender_prefix()}Found reaction (on second try), returning True')
                 return True  # Notify that reaction was found
             except asyncio.TimeoutError:
@@ -71,6 +71,19 @@ def hint_to_review(hint_message: str, author: discord.Member) -> discord.Embed:
     return ut.make_embed(name=hint_message, value=compute_proper_nickname(author))
 
 
+def hints_to_review(hint_list: List[Hint], check_emoji) -> discord.Embed:
+    embed = discord.Embed(
+        title="Tippphase beendet",
+        color=ut.orange,
+        description=f"Wählt eventuell doppelte Tipps aus, indem ihr auf ihre Nummer klickt.\n"
+                    f"Alle doppelten Tipps markiert? Dann bestätigt es mit {check_emoji}!"
+    )
+    for hint in hint_list:
+        embed.add_field(name=f'{hint.veto_emoji} {hint.hint_message}', value=compute_proper_nickname(hint.author),
+                        inline=False)
+    return embed
+
+
 def confirm_massage_all_hints_reviewed() -> discord.Embed:
     return ut.make_embed(title='Alle doppelten Tipps markiert?', name='Dann bestätigt es hier!')
 
@@ -148,6 +161,14 @@ def admin_channel_name(channel: discord.TextChannel) -> str:
     return f"{channel.name}-Warteraum"
 
 
+def admin_channel_topic(bot_member: discord.Member) -> str:
+    """
+    Topic of the admin waiting channels. It marks them as created by the bot, so that they can be told apart from
+    channels of users when cleaning up after a restart
+    """
+    return f"Warteraum für die Ratenden, wird von JustOne automatisch gelöscht. [justone-waiting-room:{bot_member.id}]"
+
+
 def admin_welcome(guesser: discord.Member, emoji) -> discord.Embed:
     return ut.make_embed(
         title="Angekommen!",
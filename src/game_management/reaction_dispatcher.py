@@ -0,0 +1,67 @@
+import asyncio
+from typing import Callable, Dict, List, Tuple, Union
+
+import discord
+
+from game_management.timer_wheel import wait_for
+
+"""
+This file handles waiting for reactions. Instead of registering a check for every waiter that is run on every reaction
+event, the waiters are indexed by message id and emoji: A reaction event only looks at the waiters of its message and
+emoji, independent of the number of running games.
+The events are passed in by the on_raw_reaction_add listener (see cogs/just_one.py).
+"""
+
+Check = Callable[[discord.RawReactionActionEvent], bool]
+
+
+class ReactionDispatcher:
+    def __init__(self):
+        # Indexed by message id and emoji (as str), each waiter has an optional check and its future
+        self.waiters: Dict[Tuple[int, str], List[Tuple[Union[Check, None], asyncio.Future]]] = {}
+
+    async def wait_for(self, message_id: int, emoji: str, check: Union[Check, None] = None,
+                       timeout: Union[float, None] = None) -> discord.RawReactionActionEvent:
+        """
+        Waits for a reaction to a message
+
+        @param message_id: The message to wait for a reaction to
+        @param emoji: The emoji to wait for
+        @param check: [Optional] Only reactions (with the right emoji to the right message) passing this check count
+        @param timeout: [Optional] Seconds to wait at most
+        @return: The reaction event
+        @raise asyncio.TimeoutError: If no matching reaction was added within the timeout
+        """
+        future = asyncio.get_event_loop().create_future()
+        key = (message_id, emoji)
+        waiter = (check, future)
+        self.waiters.setdefault(key, []).append(waiter)
+        try:
+            return await wait_for(future, timeout)
+        finally:
+            waiters = self.waiters.get(key)
+            if waiters is not None:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.waiters[key]
+
+    def dispatch(self, payload: discord.RawReactionActionEvent):
+        """
+        Resolves the waiters of the message and emoji of a reaction event whose check passes
+
+        @param payload: The reaction event
+        """
+        waiters = self.waiters.get((payload.message_id, str(payload.emoji)))
+        if not waiters:
+            return
+        for (check, future) in list(waiters):
+            if future.done():
+                continue
+            try:
+                if check is None or check(payload):
+                    future.set_result(payload)
+            except Exception as e:
+                future.set_exception(e)
+
+
+dispatcher = ReactionDispatcher()
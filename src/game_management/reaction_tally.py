@@ -0,0 +1,72 @@
+from collections import Counter
+from typing import Dict, Iterable
+
+import discord
+
+from log_setup import logger
+
+
+class ReactionTally:
+    """
+    Counts the reactions to the messages in a channel from the raw reaction events, so that the reactions to a message
+    are known without fetching it. The reactions of the bot itself are not counted.
+    Events that happen while the bot is disconnected are lost, the tally is marked as stale then and has to be
+    reconciled with the actual messages before relying on it.
+    """
+    def __init__(self, bot_user_id: int):
+        self.bot_user_id = bot_user_id
+        self.counts: Dict[int, Counter] = {}  # Indexed by message id, counts reactions per emoji (as str)
+        self.stale = False  # Whether events might have been missed
+
+    def add(self, payload: discord.RawReactionActionEvent):
+        """
+        Counts a reaction, called by the on_raw_reaction_add listener
+        """
+        if payload.user_id == self.bot_user_id:
+            return
+        self.counts.setdefault(payload.message_id, Counter())[str(payload.emoji)] += 1
+
+    def remove(self, payload: discord.RawReactionActionEvent):
+        """
+        Removes a reaction, called by the on_raw_reaction_remove listener
+        """
+        if payload.user_id == self.bot_user_id:
+            return
+        counter = self.counts.get(payload.message_id)
+        if counter and counter[str(payload.emoji)] > 0:
+            counter[str(payload.emoji)] -= 1
+
+    def count(self, message_id: int, emoji: str) -> int:
+        """
+        @param message_id: The message to look up
+        @param emoji: The emoji to count
+        @return: Number of users (except the bot) that reacted to the message with the emoji
+        """
+        counter = self.counts.get(message_id)
+        return counter[emoji] if counter else 0
+
+    def mark_stale(self):
+        self.stale = True
+
+    async def reconcile(self, channel: discord.TextChannel, message_ids: Iterable[int]):
+        """
+        Replaces the tallies of the given messages by their actual reactions. The messages are fetched together by
+        reading the channel history between the oldest and the newest of them.
+
+        @param channel: The channel the messages are in
+        @param message_ids: The messages to reconcile
+        """
+        message_ids = set(message_ids)
+        self.stale = False
+        if not message_ids:
+            return
+        found = 0
+        async for message in channel.history(limit=None, before=discord.Object(max(message_ids) + 1),
+                                             after=discord.Object(min(message_ids) - 1)):
+            if message.id not in message_ids:
+                continue
+            found += 1
+            self.counts[message.id] = Counter({
+                str(reaction.emoji): reaction.count - (1 if reaction.me else 0) for reaction in message.reactions
+            })
+        logger.info(f'[Reaction Tally] Reconciled {found} of {len(message_ids)} messages in channel {channel.id}')
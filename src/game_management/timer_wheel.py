@@ -0,0 +1,165 @@
+import asyncio
+import math
+from typing import Callable, List, Set, Union
+
+from log_setup import logger
+
+"""
+This file contains the process-wide timer wheel that all games register their timeouts with. Instead of one sleeping
+task (or timer handle of the event loop) per timeout, the wheel keeps the timers in buckets and advances once per
+tick while there are timers at all. Scheduling and cancelling a timer is O(1).
+
+The wheel is hierarchical: Level 0 has one bucket per tick, each bucket of level n + 1 covers a whole turn of level n.
+Timers far in the future are placed in a higher level and moved down (cascaded) once their bucket is reached, so that
+they are visited only once per level.
+"""
+
+TICK = 1.0  # Seconds per tick, the resolution of the timers
+SLOTS = 64  # Buckets per level
+LEVELS = 3  # 64 ** 3 ticks, i.e. about three days. Timers further in the future are cascaded more than once
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'bucket')
+
+    def __init__(self, deadline: int, callback: Callable[[], None]):
+        self.deadline = deadline  # Tick at which the timer fires
+        self.callback = callback
+        self.bucket: Union[Set['Timer'], None] = None  # Bucket the timer is in, None if fired or cancelled
+
+    def cancel(self):
+        """
+        Cancels the timer, does nothing if it has already fired
+        """
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+    def active(self) -> bool:
+        return self.bucket is not None
+
+
+class TimerWheel:
+    def __init__(self, tick: float = TICK, slots: int = SLOTS, levels: int = LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.wheels: List[List[Set[Timer]]] = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.now = 0  # Current tick
+        self.origin = 0.0  # Event loop time of tick 0
+        self.handle: Union[asyncio.TimerHandle, None] = None  # Next tick, None while there are no timers
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """
+        Registers a timer
+
+        @param delay: Seconds after which the callback is called, rounded up to full ticks
+        @param callback: Function to call, it is called from the event loop
+        @return: The timer, use it to cancel or reschedule the timer
+        """
+        timer = Timer(self._deadline(delay), callback)
+        self._place(timer)
+        return timer
+
+    def reschedule(self, timer: Timer, delay: float) -> Timer:
+        """
+        Moves a timer, e.g. to extend a timeout. The timer is registered again if it has already fired
+
+        @param timer: The timer to move
+        @param delay: Seconds from now after which the callback is called
+        @return: The (moved) timer
+        """
+        timer.cancel()
+        timer.deadline = self._deadline(delay)
+        self._place(timer)
+        return timer
+
+    def _deadline(self, delay: float) -> int:
+        """
+        Starts turning the wheel if it is idle
+
+        @param delay: Seconds from now
+        @return: The tick at which a timer with the given delay is due
+        """
+        loop = asyncio.get_event_loop()
+        if self.handle is None:  # The wheel is idle, start turning it from the current tick on
+            self.origin = loop.time() - self.now * self.tick
+            self.handle = loop.call_at(self.origin + (self.now + 1) * self.tick, self._advance)
+        return max(math.ceil((loop.time() + delay - self.origin) / self.tick), self.now + 1)
+
+    def __len__(self):
+        return sum(len(bucket) for wheel in self.wheels for bucket in wheel)
+
+    def _place(self, timer: Timer, due: Union[List[Timer], None] = None):
+        """
+        Puts a timer into the bucket of the lowest level that is reached again before its deadline
+        """
+        if timer.deadline <= self.now:
+            if due is not None:
+                due.append(timer)
+                return
+            timer.deadline = self.now + 1
+        span = 1
+        for (level, wheel) in enumerate(self.wheels):
+            turn = span * self.slots  # Ticks per turn of this level
+            if timer.deadline // turn == self.now // turn or level == len(self.wheels) - 1:
+                timer.bucket = wheel[(timer.deadline // span) % self.slots]
+                timer.bucket.add(timer)
+                return
+            span *= self.slots
+
+    def _advance(self):
+        """
+        Advances the wheel to the current time and fires the timers that are due
+        """
+        loop = asyncio.get_event_loop()
+        while self.origin + (self.now + 1) * self.tick <= loop.time():
+            self.now += 1
+            due: List[Timer] = []
+            # Cascade the timers of higher levels whose bucket is reached now, top-down so they reach level 0 in time
+            for level in range(len(self.wheels) - 1, 0, -1):
+                span = self.slots ** level
+                if self.now % span == 0:
+                    bucket = self.wheels[level][(self.now // span) % self.slots]
+                    timers = list(bucket)
+                    bucket.clear()
+                    for timer in timers:
+                        self._place(timer, due)
+            bucket = self.wheels[0][self.now % self.slots]
+            due += bucket
+            bucket.clear()
+            for timer in due:
+                timer.bucket = None
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logger.error('[Timer Wheel] Timer callback failed', exc_info=e)
+        if len(self):
+            self.handle = loop.call_at(self.origin + (self.now + 1) * self.tick, self._advance)
+        else:
+            self.handle = None  # Idle until the next timer is scheduled
+
+
+wheel = TimerWheel()
+
+
+async def wait_for(future: asyncio.Future, timeout: Union[float, None]):
+    """
+    Like asyncio.wait_for for a future, but with the timeout registered with the timer wheel
+
+    @param future: The future to wait for
+    @param timeout: Seconds to wait at most, None to wait forever
+    @return: The result of the future
+    @raise asyncio.TimeoutError: If the future is not done within the timeout
+    """
+    if timeout is None:
+        return await future
+
+    def expire():
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    timer = wheel.schedule(timeout, expire)
+    try:
+        return await future
+    finally:
+        timer.cancel()
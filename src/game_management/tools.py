@@ -8,7 +8,8 @@ class Hint:
         self.author = message.author
         self.hint_message = message.content
         self.valid = True
-        self.message_id = 0
+        self.message_id = 0  # The message showing the hint for reviewing
+        self.veto_emoji = ''  # The reaction to that message that vetoes the hint
 
     def strike(self):
         self.valid = False
@@ -58,10 +59,10 @@ class Phase(Enum):
     # While they are executed, game will still be in Phase show_summary
     wait_for_play_again_in_closed_mode = 1000
     wait_for_play_again_in_open_mode = 1001
-    wait_for_stop_game_after_timeout = 1002
     clear_messages = 1003
     play_new_game = 1004
     fatal_forbidden = 1005
+    warm_up_next_round = 1006  # Preparing the next round while the summary is shown
 
 
 class Key(Enum):
@@ -0,0 +1,176 @@
+import asyncio
+from typing import Dict, List, Set, Tuple, Union
+
+import discord
+
+import game_management.output as output
+from database.resource_journal import journal as resource_journal
+from environment import WAITING_ROOM_IDLE_TIMEOUT
+from game_management.timer_wheel import Timer, wheel
+from log_setup import logger
+
+"""
+This file pools the waiting rooms of guessers in admin mode (administrators can't be locked out of a channel, so they
+wait in a separate channel). Creating channels is heavily rate limited, so a room is not deleted after a round but
+hidden and kept for the next round in the same category. Rooms that are not used for WAITING_ROOM_IDLE_TIMEOUT seconds
+are deleted.
+Pooled rooms stay recorded as resources of type 'text_channel', so they are deleted on the next start if the bot stops.
+"""
+
+PoolKey = Tuple[int, int]  # (guild id, category id or 0)
+
+
+def pool_key(channel: discord.TextChannel) -> PoolKey:
+    return channel.guild.id, channel.category_id or 0
+
+
+def room_overwrites(guild: discord.Guild, guesser: Union[discord.Member, None] = None) \
+        -> Dict[Union[discord.Role, discord.Member], discord.PermissionOverwrite]:
+    """
+    @param guild: The guild of the room
+    @param guesser: The guesser waiting in the room, None for an idle room
+    @return: The overwrites of a waiting room: Hidden for everyone except the bot (and the guesser)
+    """
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        guild.me: discord.PermissionOverwrite(read_messages=True),
+    }
+    if guesser:
+        overwrites[guesser] = discord.PermissionOverwrite(view_channel=True, add_reactions=True)
+    return overwrites
+
+
+class WaitingRoomPool:
+    def __init__(self, idle_timeout: float = WAITING_ROOM_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.idle: Dict[PoolKey, List[Tuple[discord.TextChannel, Timer]]] = {}  # Idle rooms with their reclaim timers
+        self.deletions: Set[asyncio.Task] = set()  # Strong references to the running deletions of reclaimed rooms
+
+    async def acquire(self, channel: discord.TextChannel, guesser: discord.Member) -> discord.TextChannel:
+        """
+        Gets a waiting room for a game, either an idle one of the category (retargeted to the guesser) or a new one
+
+        @param channel: The channel of the game
+        @param guesser: The guesser that waits in the room
+        @return: The waiting room, only visible to the bot and the guesser
+        @raise discord.Forbidden: If the bot is not allowed to create or edit the room
+        """
+        name = output.admin_channel_name(channel)
+        room = self.take_idle(channel, name)
+        if room:
+            await self.retarget(room, channel, guesser)
+            return room
+
+        room = await channel.guild.create_text_channel(
+            name=name,
+            category=channel.category,
+            topic=output.admin_channel_topic(channel.guild.me),
+            reason="Create waiting channel",
+            overwrites=room_overwrites(channel.guild, guesser)
+        )
+        # Add channel to created resources so we can delete it even after restart
+        resource_journal.add(channel.guild.id, room.id, resource_type="text_channel")
+        logger.info(f'[Waiting Rooms] [Guild {channel.guild.id}] Created waiting room {room.id}')
+        return room
+
+    async def hand_over(self, room: discord.TextChannel, channel: discord.TextChannel,
+                        guesser: discord.Member) -> discord.TextChannel:
+        """
+        Passes the room of a round that is stopping directly to the next round, without putting it into the pool
+
+        @param room: The room of the stopping round
+        @param channel: The channel of the game
+        @param guesser: The guesser of the next round
+        @return: The waiting room, a new one if the room has been deleted in the meantime
+        @raise discord.Forbidden: If the bot is not allowed to edit or create the room
+        """
+        try:
+            await self.retarget(room, channel, guesser)
+        except discord.NotFound:
+            resource_journal.delete(room.guild.id, value=room.id, resource_type="text_channel")
+            return await self.acquire(channel, guesser)
+        return room
+
+    @staticmethod
+    async def retarget(room: discord.TextChannel, channel: discord.TextChannel, guesser: discord.Member):
+        """
+        Makes a room visible to (only) the given guesser and names it after the channel of the game, in one request
+        """
+        name = output.admin_channel_name(channel)
+        options = {'overwrites': room_overwrites(channel.guild, guesser)}
+        if room.name != name.lower():  # Renaming is rate limited even more than editing, avoid it if possible
+            options['name'] = name
+        await room.edit(reason="Reuse waiting channel", **options)
+        logger.info(f'[Waiting Rooms] [Guild {channel.guild.id}] Reused waiting room {room.id}')
+
+    def take_idle(self, channel: discord.TextChannel, name: str) -> Union[discord.TextChannel, None]:
+        """
+        Takes an idle room of the category out of the pool, preferably one that already has the right name
+
+        @param channel: The channel of the game
+        @param name: The name the room should have
+        @return: The room, None if there is no idle room
+        """
+        rooms = self.idle.get(pool_key(channel))
+        while rooms:
+            index = next((i for (i, (room, _)) in enumerate(rooms) if room.name == name.lower()), len(rooms) - 1)
+            (room, timer) = rooms.pop(index)
+            timer.cancel()
+            if channel.guild.get_channel(room.id):  # Skip rooms that have been deleted manually
+                return room
+            resource_journal.delete(channel.guild.id, value=room.id, resource_type="text_channel")
+        return None
+
+    async def release(self, room: discord.TextChannel):
+        """
+        Empties a room after a round and hides it from the guesser, so that it can be reused.
+        The room is deleted if that is not possible
+
+        @param room: The waiting room to release
+        """
+        try:
+            await room.purge(limit=None)
+            await room.edit(overwrites=room_overwrites(room.guild), reason="Hide waiting channel")
+        except discord.NotFound:
+            resource_journal.delete(room.guild.id, value=room.id, resource_type="text_channel")
+            return
+        except discord.Forbidden:
+            logger.warning(f'[Waiting Rooms] [Guild {room.guild.id}] Could not clear waiting room {room.id}, '
+                           f'deleting it instead')
+            await self.delete(room)
+            return
+        key = pool_key(room)
+        timer = wheel.schedule(self.idle_timeout, lambda: self.reclaim(key, room))
+        self.idle.setdefault(key, []).append((room, timer))
+
+    def reclaim(self, key: PoolKey, room: discord.TextChannel):
+        """
+        Removes a room that has been idle for too long from the pool and deletes it. Called by the timer wheel
+        """
+        rooms = self.idle.get(key, [])
+        self.idle[key] = [(idle_room, timer) for (idle_room, timer) in rooms if idle_room.id != room.id]
+        if not self.idle[key]:
+            del self.idle[key]
+        task = asyncio.ensure_future(self.delete(room))
+        self.deletions.add(task)
+        task.add_done_callback(self.deletion_done)
+
+    def deletion_done(self, task: asyncio.Task):
+        self.deletions.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f'[Waiting Rooms] Deleting a reclaimed waiting room failed: {task.exception()}')
+
+    @staticmethod
+    async def delete(room: discord.TextChannel):
+        try:
+            await room.delete(reason="Waiting channel not needed anymore")
+        except discord.NotFound:
+            pass
+        except discord.Forbidden:
+            logger.fatal(f'[Waiting Rooms] [Guild {room.guild.id}] Could not delete waiting room {room.id}')
+            return
+        resource_journal.delete(room.guild.id, value=room.id, resource_type="text_channel")
+        logger.info(f'[Waiting Rooms] [Guild {room.guild.id}] Deleted waiting room {room.id}')
+
+
+pool = WaitingRoomPool()
@@ -1,20 +1,269 @@
 import database.db_access as dba
+import bisect
+import hashlib
+import os
 import random
+import threading
 
 from discord.ext import commands
-from typing import List, Union, Tuple
+from typing import Dict, List, Sequence, Union, Tuple
 import json
-from environment import DEFAULT_DISTRIBUTION
+from environment import DEFAULT_DISTRIBUTION, WORDPOOL_FILE, WORDSTORE_FILE
+from game_management.custom_pools import get_custom_words, pool_generation
+from game_management.word_store import open_store
+from log_setup import logger
 
 # This file handles the wordpools.json file and provides functions to read from it
 
 
+class WordPoolRegistry:
+    """
+    Process-wide cache of the word pools. The json file is parsed only once and then served from memory.
+    On every lookup, the modification time of the file is checked, and the file is only read again if it changed.
+    Parsing is skipped as well if the content hash of the file is still the same.
+    If a precompiled word store (see word_store.py) matching the content hash exists, it is memory mapped instead of
+    parsing the json file, so that words are only decoded once they are drawn.
+    """
+    def __init__(self, path: str = WORDPOOL_FILE, store_path: str = WORDSTORE_FILE):
+        self.path = path
+        self.store_path = store_path
+        self.pools: dict = {}
+        self.names: List[str] = []
+        self.mtime = None
+        self.content_hash = None
+        self.generation = 0  # Increased on every actual reload, so that dependent caches can notice changes
+
+    def _load(self, force=False) -> bool:
+        """
+        Reads the word pool file if its modification time (or content) changed
+
+        @param force: Whether to read and parse the file regardless of modification time and content hash
+        @return: Whether the word pools have been replaced
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        if not force and mtime == self.mtime:
+            return False
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        self.mtime = mtime
+        content_hash = hashlib.sha256(content).hexdigest()
+        if not force and content_hash == self.content_hash:
+            return False
+        pools = open_store(content_hash, self.store_path)
+        if pools is None:  # Fall back to the json file
+            pools = json.loads(content)  # Throws ValueError if file is no valid json, old pools are kept then
+        self.pools = pools
+        self.names = sorted(self.pools.keys())
+        self.content_hash = content_hash
+        self.generation += 1
+        logger.info(f'[Word Pools] Loaded {len(self.names)} word pools from {self.path} (hash {content_hash[:12]})')
+        return True
+
+    def refresh(self) -> bool:
+        """
+        Reloads the word pools if the file changed. Errors are logged and the previously loaded pools stay in use.
+
+        @return: Whether the word pools have been replaced
+        """
+        try:
+            return self._load()
+        except (OSError, ValueError) as e:
+            if not self.pools:
+                raise  # Nothing to fall back to
+            logger.error(f'[Word Pools] Could not reload {self.path}, keeping previous word pools: {e}')
+            return False
+
+    def reload(self) -> bool:
+        """
+        Forces a reload of the word pools. Errors are passed to the caller, the previous pools stay in use then.
+
+        @return: Whether the word pools have been replaced (this is always the case if no error occurs)
+        """
+        return self._load(force=True)
+
+    def get(self) -> dict:
+        """
+        @return: The (up-to-date) dictionary of word pools
+        """
+        self.refresh()
+        return self.pools
+
+
+registry = WordPoolRegistry()
+# Cache of the WordPoolDistribution of each guild, indexed by guild id
+guild_distributions: Dict[int, 'WordPoolDistribution'] = {}
+
+
+class WordSampler:
+    """
+    Precompiled sampler for a WordPoolDistribution.
+    Conceptually, the sampler represents the pool where each word is contained as often as the weight of its wordpool,
+    but it never builds this pool. Instead, it stores the cumulative sizes of the weighted blocks (one per wordpool)
+    and maps a uniformly drawn position to its block using bisect, and then to the word inside the block.
+    Drawing thus takes O(log n) for n wordpools and does not allocate anything.
+    """
+    def __init__(self, blocks: List[Tuple[Sequence[str], int]]):
+        """
+        @param blocks: List of pairs (words, weight) to compile. Empty pools and non-positive weights are skipped
+        """
+        self.pools: List[Sequence[str]] = []
+        self.starts: List[int] = []  # Position of the first entry of each block
+        self.bounds: List[int] = []  # Position after the last entry of each block, used for bisect
+        self.total = 0
+        for (words, weight) in blocks:
+            if not words or weight <= 0:
+                continue
+            self.pools.append(words)
+            self.starts.append(self.total)
+            self.total += len(words) * weight
+            self.bounds.append(self.total)
+
+    def __len__(self):
+        """
+        @return: The size of the (virtual) weighted pool
+        """
+        return self.total
+
+    def word_at(self, position: int) -> str:
+        """
+        @param position: Position in the virtual weighted pool, 0 <= position < len(self)
+        @return: The word at the given position
+        """
+        block = bisect.bisect_right(self.bounds, position)
+        words = self.pools[block]
+        return words[(position - self.starts[block]) % len(words)]
+
+    def draw(self) -> str:
+        """
+        @return: A word drawn uniformly from the weighted pool
+        """
+        if self.total == 0:
+            raise ValueError('Cannot draw a word from an empty word pool distribution')
+        return self.word_at(random.randrange(self.total))
+
+
+DECK_MAX_SIZE = 2 ** 32  # Larger weighted pools are drawn with replacement, even in deck mode
+MASK64 = (1 << 64) - 1
+
+
+def mix(value: int) -> int:
+    """
+    @return: A well mixed 64 bit hash of a (64 bit) integer (the finalizer of splitmix64)
+    """
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class WordDeck:
+    """
+    Draws positions of a WordSampler without replacement, so that no word is repeated until the whole (weighted)
+    pool has been drawn. Afterwards, the deck is reshuffled.
+    The permutation of the positions is never stored: The i-th drawn position is the image of i under a permutation of
+    range(size) that is computed on the fly from the seed (a Feistel network, restricted to range(size) by cycle
+    walking). The state is therefore just (seed, cursor) and the few positions that have been put back, it takes
+    constant memory independent of the size and can be restored without replaying anything.
+    """
+    ROUNDS = 4
+
+    def __init__(self, size: int, seed: Union[int, None] = None, cursor: int = 0,
+                 returned: Union[List[int], None] = None):
+        """
+        @param size: Size of the weighted pool to draw positions of
+        @param seed: Seed of the current shuffle. A random one is chosen if not given
+        @param cursor: Number of positions already drawn with this seed. Used to restore a persisted deck
+        @param returned: Positions that have been put back and are drawn next. Used to restore a persisted deck
+        """
+        self.size = size
+        self.cursor = min(cursor, size)
+        self.returned: List[int] = [position for position in returned or [] if position < size]
+        self.shuffle(random.getrandbits(64) if seed is None else seed)
+
+    def shuffle(self, seed: int):
+        self.seed = seed
+        self.keys = [mix(seed + i) for i in range(self.ROUNDS)]
+        self.half_bits = max(1, ((self.size - 1).bit_length() + 1) // 2)
+
+    def permute(self, index: int) -> int:
+        """
+        @param index: 0 <= index < size
+        @return: The image of index under the permutation of the current seed
+        """
+        half_bits, half_mask = self.half_bits, (1 << self.half_bits) - 1
+        value = index
+        while True:  # Cycle walking: the network permutes range(4 ** half_bits), at most 4 times as large as size
+            (left, right) = (value >> half_bits, value & half_mask)
+            for key in self.keys:
+                (left, right) = (right, left ^ (mix(right ^ key) & half_mask))
+            value = (left << half_bits) | right
+            if value < self.size:
+                return value
+
+    def next_position(self) -> int:
+        """
+        @return: The next position of the deck. Reshuffles the deck if it is exhausted
+        """
+        if self.returned:
+            return self.returned.pop()
+        if self.cursor >= self.size:
+            self.shuffle(random.getrandbits(64))
+            self.cursor = 0
+        self.cursor += 1
+        return self.permute(self.cursor - 1)
+
+    def put_back(self, position: int):
+        """
+        Puts a drawn position back, it is drawn again next
+
+        @param position: A position returned by next_position()
+        """
+        self.returned.append(position)
+
+    def get_state(self) -> str:
+        """
+        @return: String representation of the state that can be persisted and restored with from_state()
+        """
+        returned = ','.join(str(position) for position in self.returned)
+        return f'v2:{self.seed}:{self.cursor}:{self.size}:{returned}'
+
+    @staticmethod
+    def from_state(state: Union[str, None], size: int) -> 'WordDeck':
+        """
+        Restores a deck from a persisted state. Starts a new deck if the state is invalid or belongs to a pool of
+        another size (i.e. the word pools changed in the meantime)
+        @param state: A state as returned by get_state()
+        @param size: Size of the weighted pool to draw positions of
+        @return: The restored (or a new) WordDeck
+        """
+        try:
+            (version, seed, cursor, old_size, *rest) = state.split(':')
+            (seed, cursor, old_size) = (int(seed), int(cursor), int(old_size))
+            returned = [int(position) for position in rest[0].split(',') if position] if rest else []
+        except (AttributeError, ValueError):
+            return WordDeck(size)
+        if version != 'v2' or old_size != size:
+            return WordDeck(size)
+        return WordDeck(size, seed=seed, cursor=cursor, returned=returned)
+
+
+# Draws in deck mode run on the (multiple) database threads. They are serialized per guild, so that the persisted state
+# of a deck is never overwritten by an older one
+deck_locks: Dict[int, threading.Lock] = {}
+
+
+def deck_lock(guild_id: Union[int, None]) -> threading.Lock:
+    if guild_id is None:
+        return threading.Lock()
+    return deck_locks.setdefault(guild_id, threading.Lock())
+
+
 class WordPoolDistribution:  # Class used to manage the distribution of wordpools
     """
     Wrapper class representing a distribution of the word pools to be drawn of. Settings might be expanded in the future
     so that guilds can save word pools with names for faster switching between them
     """
-    def __init__(self, distribution):  # Saves a natural number for each word_pool
+    def __init__(self, distribution, guild_id: Union[int, None] = None, deck_mode=False):
         """
         Constructor for a WordPoolDistribution
 
@@ -22,12 +271,66 @@ class WordPoolDistribution:  # Class used to manage the distribution of wordpool
                 Currently, wordpool name can be one of the following:
                 classic_main, classic_weird, extension_main, extension_weird, nsfw, gandhi
                 For more, see available_word_pools() in this file
+        @param guild_id: The guild this distribution belongs to. Needed to persist the deck in deck mode
+        @param deck_mode: Whether to draw without replacement (see WordDeck) instead of independently each time
         """
         self.distribution = distribution
+        self.guild_id = guild_id
+        self.deck_mode = deck_mode
+        self.sampler: Union[WordSampler, None] = None  # Compiled lazily by get_sampler()
+        self.sampler_generation = None  # Generations of the registry and custom pools the sampler was compiled with
+        self.deck: Union[WordDeck, None] = None  # Created lazily by get_deck() if in deck mode
+        self.deck_lock = deck_lock(guild_id)
 
     def get_distribution(self):  # Returns the distribution of itself. Method for future in case return type changes
         return self.distribution
 
+    def needs_database(self) -> bool:
+        """
+        @return: Whether drawing from this distribution accesses the database, i.e. if it is in deck mode or
+                contains custom pools. Words then have to be drawn on the database thread, see draw_word()
+        """
+        pools = get_wordpools()
+        return self.deck_mode or any(wordpool not in pools for (wordpool, _) in self.distribution)
+
+    def get_sampler(self) -> WordSampler:
+        """
+        Get the compiled sampler of this distribution. The sampler is compiled once and cached, it is only compiled
+        again if the word pools have been reloaded or custom pools of the guild have been replaced in the meantime.
+        Compiling accesses the database if the distribution contains custom pools.
+        @return: The WordSampler for this distribution
+        """
+        registry.refresh()
+        generation = (registry.generation, pool_generation(self.guild_id))
+        if self.sampler is None or self.sampler_generation != generation:
+            blocks = []
+            for (wordpool, weight) in self.distribution:
+                words = get_words(wordpool, guild_id=self.guild_id)
+                if words:
+                    blocks.append((words, weight))
+                else:
+                    logger.warning(f'[Word Pools] Ignoring wrongly given wordpool {wordpool}')
+            self.sampler = WordSampler(blocks)
+            self.sampler_generation = generation
+        return self.sampler
+
+    def get_deck(self) -> WordDeck:
+        """
+        Get the deck of this distribution, restoring its persisted state (if any) on first use.
+        A new deck is started if the size of the weighted pool changed.
+        @return: The WordDeck for this distribution
+        """
+        size = len(self.get_sampler())
+        if self.deck is None:
+            state = None
+            if self.guild_id is not None:
+                entry = dba.get_settings_for.blocking(self.guild_id, setting='deck-state')
+                state = entry[0].value if entry else None
+            self.deck = WordDeck.from_state(state, size)
+        elif self.deck.size != size:
+            self.deck = WordDeck(size)
+        return self.deck
+
     def __str__(self):
         """
         Nice representation of WordPoolDistribution for the logger
@@ -40,7 +343,8 @@ def available_word_pools() -> List[str]:
     """
     @return: List[str]: A list of the existing word pools (in the json file) - sorted
     """
-    return sorted(get_wordpools().keys())
+    registry.refresh()
+    return registry.names
 
 
 def get_description(wordpool_name: str) -> Union[str, None]:
@@ -50,8 +354,9 @@ def get_description(wordpool_name: str) -> Union[str, None]:
     @return: Union[str, None] Description of the wordpool if wordpool exists. None otherwise.
     """
     #  Give back the description of a wordpool using its string name
-    if wordpool_name in available_word_pools():
-        return get_wordpools()[wordpool_name]['description']
+    pool = get_wordpools().get(wordpool_name)
+    if pool:
+        return pool['description']
     return None
 
 
@@ -62,63 +367,148 @@ def get_pools_with_description() -> List[Tuple[str, str]]:
     return [(pool, get_description(pool)) for pool in available_word_pools()]
 
 
-def get_words(wordpool_name: str) -> Union[List[str], None]:
+def get_words(wordpool_name: str, guild_id: Union[int, None] = None) -> Union[Sequence[str], None]:
     """
     Get the words in a word pool.
     @param wordpool_name: str name of the word pool.
-    @return: List[str]. The list of words from this wordpool. None, if pool does not exist.
+    @param guild_id: If given, the custom pools of this guild are searched as well (see custom_pools.py)
+    @return: Sequence[str]. The (read-only) list of words from this wordpool. None, if pool does not exist.
     """
     # Give back the words contained in a wordpool using its string name
-    if wordpool_name in available_word_pools():
-        return get_wordpools()[wordpool_name]['words']
+    pool = get_wordpools().get(wordpool_name)
+    if pool:
+        return pool['words']
+    if guild_id is not None:
+        return get_custom_words(guild_id, wordpool_name)
+
+
+async def draw_word(word_pool_distribution: WordPoolDistribution) -> str:
+    """
+    Draw a word from the wordpools without blocking the event loop, see getword() for details.
+    @param word_pool_distribution: The wordpool distribution to be drawn of
+    @return: A random word drawn from the wordpools
+    """
+    if word_pool_distribution.needs_database():
+        return await dba.run_blocking(getword, word_pool_distribution)
+    return getword(word_pool_distribution)
 
 
 def getword(word_pool_distribution: WordPoolDistribution):
     """
-    Draw a word from the wordpools.
+    Draw a word from the wordpools. This accesses the database if word_pool_distribution.needs_database(), so only
+    call this directly on the database thread then, otherwise use draw_word().
     @param word_pool_distribution: The wordpool distribution to be drawn of
     @return: A random word drawn from the wordpools according to the distribution as fallows:
             We create a pool where each word is contained as often as the weight of its wordpool (so excluded if the
             wordpool is not part of the WordPoolDistribution), and draw uniformly from it.
             This is useful to weight smaller lists and thus draw from them more often, however also getting more
             repeations within that list.
+            The pool is never built explicitly, see WordSampler for details.
+            If the distribution is in deck mode, words are drawn from this pool without replacement instead,
+            see WordDeck for details.
     """
-    # Choose a word using the given distribution of wordpools
-    # Create the custom wordpool to draw a word from:
-    pool: [str] = []
-    for (wordpool, weight) in word_pool_distribution.get_distribution():
-        words = get_words(wordpool)
-        if words:
-            pool += (get_words(wordpool) * weight)
-        else:
-            print('Ignoring wrongly given wordpool')
+    return draw_position(word_pool_distribution)[0]
+
+
+async def reserve_word(word_pool_distribution: WordPoolDistribution) -> Tuple[str, Union[int, None]]:
+    """
+    Like draw_word(), but the word can be put back into the deck with release_word() if it is not used after all
+    @param word_pool_distribution: The wordpool distribution to be drawn of
+    @return: The word and its position in the deck (None if the distribution is not in deck mode)
+    """
+    if word_pool_distribution.needs_database():
+        return await dba.run_blocking(draw_position, word_pool_distribution)
+    return draw_position(word_pool_distribution)
+
 
-    return pool[random.randint(0, len(pool)-1)]  # draw word and return it
+async def release_word(word_pool_distribution: WordPoolDistribution, position: Union[int, None]):
+    """
+    Puts a word drawn with reserve_word() back into the deck, so that it is drawn next
+    @param word_pool_distribution: The wordpool distribution the word has been drawn of
+    @param position: The position returned by reserve_word()
+    """
+    if position is not None:
+        await dba.run_blocking(put_back_position, word_pool_distribution, position)
 
 
-def get_wordpools() -> dict:  # Reads the json file and returns a dictionary containing the wordpools. Internal function
+def draw_position(word_pool_distribution: WordPoolDistribution) -> Tuple[str, Union[int, None]]:
+    """
+    Blocking implementation of getword() and reserve_word()
+    @return: The word and its position in the deck (None if the distribution is not in deck mode)
+    """
+    try:
+        return draw_position_once(word_pool_distribution)
+    except LookupError as e:  # A custom pool has been replaced while drawing, compile the sampler again
+        logger.warning(f'[Word Pools] Recompiling the distribution {word_pool_distribution}: {e}')
+        word_pool_distribution.sampler = None
+        return draw_position_once(word_pool_distribution)
+
+
+def draw_position_once(word_pool_distribution: WordPoolDistribution) -> Tuple[str, Union[int, None]]:
+    sampler = word_pool_distribution.get_sampler()
+    if not word_pool_distribution.deck_mode or len(sampler) > DECK_MAX_SIZE:
+        return sampler.draw(), None
+    with word_pool_distribution.deck_lock:
+        position = word_pool_distribution.get_deck().next_position()
+        persist_deck(word_pool_distribution)
+    return sampler.word_at(position), position
+
+
+def put_back_position(word_pool_distribution: WordPoolDistribution, position: int):
+    """
+    Blocking implementation of release_word()
+    """
+    with word_pool_distribution.deck_lock:
+        deck = word_pool_distribution.get_deck()
+        if position < deck.size:  # Otherwise the pool changed in the meantime and the deck has been replaced
+            deck.put_back(position)
+            persist_deck(word_pool_distribution)
+
+
+def persist_deck(word_pool_distribution: WordPoolDistribution):
+    """
+    Persists the state of the deck, so that a restart does not reset it. Call it while holding the deck lock
+    """
+    if word_pool_distribution.guild_id is not None:
+        dba.replace_setting.blocking(word_pool_distribution.guild_id, word_pool_distribution.deck.get_state(),
+                                     setting='deck-state')
+
+
+def get_wordpools() -> dict:  # Returns the cached dictionary containing the wordpools. Internal function
     """
     Get the wordpools
-    @return: A dictionary containing the information of the wordpools
+    @return: A dictionary containing the information of the wordpools. Do not modify it, it is shared process-wide
     """
-    with open('data/wordpools.json') as file:
-        wordpool_dict = json.load(file)
-    return wordpool_dict
+    return registry.get()
 
 
-def compute_current_distribution(ctx: commands.Context) -> WordPoolDistribution:
+async def compute_current_distribution(ctx: commands.Context) -> WordPoolDistribution:
     """
-    Compute the current word pool distribution from the settings of the database server-specifically
+    Compute the current word pool distribution from the settings of the database server-specifically.
+    The distribution (and thus its compiled sampler) is cached per guild, so the database is only queried after the
+    cache has been invalidated with invalidate_distribution()
     @param ctx: The context (containing the server) from which to read the settings
     @return: A WordPoolDistribution according to the current settings of the server
     """
-    # Computes the current WordPoolDistribution using the entries of the database (the enabled wordpools)
-    distribution: List[(str, int)] = []
-    if dba.get_settings_for(ctx.guild.id) is None:
-        return WordPoolDistribution(DEFAULT_DISTRIBUTION)  # Just draw from this list
-    for setting in dba.get_settings_for(ctx.guild.id):
-        distribution.append((setting.value, setting.weight))
-    return WordPoolDistribution(distribution)
-
+    guild_id = ctx.guild.id
+    distribution = guild_distributions.get(guild_id)
+    if distribution is None:
+        # Computes the current WordPoolDistribution using the entries of the database (the enabled wordpools)
+        settings = await dba.get_settings_for(guild_id)
+        deck_mode = await dba.get_setting(guild_id, 'deck', setting='draw-mode') is not None
+        if settings is None:
+            pools = DEFAULT_DISTRIBUTION  # Just draw from this list
+        else:
+            pools = [(setting.value, setting.weight) for setting in settings]
+        distribution = WordPoolDistribution(pools, guild_id=guild_id, deck_mode=deck_mode)
+        guild_distributions[guild_id] = distribution
+    return distribution
 
 
+def invalidate_distribution(guild_id: int):
+    """
+    Drops the cached word pool distribution of a guild. Has to be called whenever the wordlist settings of the guild
+    change, the distribution is then read from the database again on next use.
+    @param guild_id: The guild whose distribution is outdated
+    """
+    guild_distributions.pop(guild_id, None)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Sequence
+from typing import Dict, Union
+
+from environment import WORDPOOL_FILE, WORDSTORE_FILE
+from log_setup import logger
+
+"""
+This file handles the precompiled binary word store, a compact version of the wordpools.json file that can be memory
+mapped, so that words only have to be decoded once they are actually drawn.
+The json file stays the source of truth: The store contains the hash of the json file it has been compiled from and
+is ignored if it does not match the current json file.
+
+Build the store (from the src directory) with
+    python3 -m game_management.word_store
+
+Layout of the store (all integers little-endian):
+    header:     magic (4 bytes), version (uint32), sha256 of the json file (32 bytes), number of pools (uint32)
+    pool table: for each pool: length of name (uint32), name (utf-8), length of description (uint32),
+                description (utf-8), number of words n (uint32), file offset of the offsets array (uint64)
+    offsets:    for each pool, n + 1 uint32 offsets of its words into the blob
+    blob:       all words (utf-8), contiguous
+"""
+
+MAGIC = b'JOWS'
+VERSION = 1
+_HEADER = struct.Struct('<4sI32sI')
+_UINT32 = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+_WORD_BOUNDS = struct.Struct('<II')
+
+
+class MappedWordList(Sequence):
+    """
+    Read-only list of the words of one pool inside a memory mapped word store. Words are decoded on access only.
+    """
+    def __init__(self, buffer: mmap.mmap, offsets_start: int, blob_start: int, length: int):
+        self.buffer = buffer
+        self.offsets_start = offsets_start
+        self.blob_start = blob_start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('word index out of range')
+        (begin, end) = _WORD_BOUNDS.unpack_from(self.buffer, self.offsets_start + 4 * index)
+        return self.buffer[self.blob_start + begin:self.blob_start + end].decode('utf-8')
+
+
+def compile_store(json_path: str = WORDPOOL_FILE, store_path: str = WORDSTORE_FILE):
+    """
+    Compiles the word pool json file into the binary word store
+
+    @param json_path: Path of the json file to compile
+    @param store_path: Path to write the store to
+    """
+    with open(json_path, 'rb') as file:
+        content = file.read()
+    pools = json.loads(content)
+
+    table = bytearray()
+    offsets_size = sum(4 * (len(pool['words']) + 1) for pool in pools.values())
+    table_size = sum(
+        20 + len(name.encode('utf-8')) + len(pool['description'].encode('utf-8')) for (name, pool) in pools.items()
+    )
+    offsets_start = _HEADER.size + table_size  # Position of the offsets array of the next pool
+    offsets = bytearray()
+    blob = bytearray()
+    for (name, pool) in pools.items():
+        encoded_name = name.encode('utf-8')
+        description = pool['description'].encode('utf-8')
+        table += _UINT32.pack(len(encoded_name)) + encoded_name
+        table += _UINT32.pack(len(description)) + description
+        table += _UINT32.pack(len(pool['words'])) + _UINT64.pack(offsets_start)
+        offsets += _UINT32.pack(len(blob))
+        for word in pool['words']:
+            blob += word.encode('utf-8')
+            offsets += _UINT32.pack(len(blob))
+        offsets_start += 4 * (len(pool['words']) + 1)
+    assert len(offsets) == offsets_size
+
+    # A running bot may have the store memory mapped, so the store is never rewritten in place. A new file is written
+    # next to it and replaces it atomically, mappings of the old file stay valid
+    (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(store_path)), prefix='.wordstore-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_HEADER.pack(MAGIC, VERSION, hashlib.sha256(content).digest(), len(pools)))
+            file.write(table)
+            file.write(offsets)
+            file.write(blob)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, 0o644)  # mkstemp creates the file readable for the owner only
+        os.replace(temp_path, store_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    logger.info(f'[Word Store] Compiled {len(pools)} word pools from {json_path} into {store_path}')
+
+
+def open_store(content_hash: str, store_path: str = WORDSTORE_FILE) -> Union[Dict[str, dict], None]:
+    """
+    Memory maps the word store if it exists and has been compiled from the given json content.
+
+    @param content_hash: Hex sha256 of the json file the store has to belong to
+    @param store_path: Path of the store
+    @return: Dictionary in the format of the json file (with MappedWordLists as words), or None if the store does not
+            exist, is outdated or is invalid
+    """
+    try:
+        with open(store_path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError is raised for empty files
+        return None
+    try:
+        (magic, version, digest, count) = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            logger.warning(f'[Word Store] {store_path} is no word store of version {VERSION}, ignoring it')
+            return None
+        if digest.hex() != content_hash:
+            logger.info(f'[Word Store] {store_path} is outdated, ignoring it. Rebuild it to use it again')
+            return None
+        pools = {}
+        position = _HEADER.size
+        entries = []
+        for _ in range(count):
+            (length,) = _UINT32.unpack_from(buffer, position)
+            name = buffer[position + 4:position + 4 + length].decode('utf-8')
+            position += 4 + length
+            (length,) = _UINT32.unpack_from(buffer, position)
+            description = buffer[position + 4:position + 4 + length].decode('utf-8')
+            position += 4 + length
+            (words, offsets_start) = struct.unpack_from('<IQ', buffer, position)
+            position += 12
+            entries.append((name, description, words, offsets_start))
+        blob_start = position + sum(4 * (words + 1) for (_, _, words, _) in entries)
+        for (name, description, words, offsets_start) in entries:
+            pools[name] = {
+                'description': description,
+                'words': MappedWordList(buffer, offsets_start, blob_start, words)
+            }
+    except (struct.error, UnicodeDecodeError) as e:
+        logger.warning(f'[Word Store] {store_path} is corrupted, ignoring it: {e}')
+        return None
+    logger.info(f'[Word Store] Memory mapped {len(pools)} word pools from {store_path}')
+    return pools
+
+
+if __name__ == '__main__':
+    compile_store(*sys.argv[1:3])
@@ -3,9 +3,10 @@ from discord.ext import commands
 
 import database.db_access as dba
 import game_management.output as output
-from environment import PREFIX, TOKEN
-from game_management.game import find_game
-from game_management.tools import Group
+from database.resource_journal import journal as resource_journal
+from environment import PREFIX, ROLE_NAME, TOKEN
+from game_management.message_router import MessageRouter
+from permission_management.moderator import get_mod_roles, load_mod_roles
 # setup of logging and env-vars
 # logging must be initialized before environment, to enable logging in environment
 from log_setup import logger
@@ -19,6 +20,8 @@ https://github.com/kesslermaximilian/JustOneBot
 
 intents = discord.Intents.all()
 bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+router = MessageRouter(bot)  # Routes all messages to the commands and the running games
+resources_cleaned_up = False  # Whether the resources of previous runs have been deleted
 
 
 # login message
@@ -38,45 +41,96 @@ async def on_ready():
     await bot.change_presence(
         activity=discord.Activity(type=discord.ActivityType.watching, name=f"{PREFIX}help"))
 
-    # Deleting all open resources from previous runs
-    role_entries = dba.get_resources(resource_type="role")  # roles
-    if role_entries:
-        for entry in role_entries:
-            for g in bot.guilds:
-                if g.id == entry.guild_id:
-                    try:
-                        await g.get_role(entry.value).delete()
-                        break  # Break the iteration over the guilds
-                    except:
-                        print('Role not found on this server')
-            dba.del_resource(g.id, value=entry.value, resource_type="role")  # Delete role from database now
-
-    text_channel_entries = dba.get_resources(resource_type="text_channel")  # Text Channels
-    if text_channel_entries:
-        for entry in text_channel_entries:
-            for g in bot.guilds:
-                if g.id == entry.guild_id:
-                    try:
-                        await g.get_channel(entry.value).delete()
-                        break  # Break the iteration over the guilds
-                    except:
-                        print('TextChannel not found on this server')
-            dba.del_resource(g.id, value=entry.value, resource_type="text_channel")  # Delete role from database now
+    await load_mod_roles()
+    for g in bot.guilds:
+        get_mod_roles(g)  # Prunes roles that have been deleted while the bot was offline
+
+    # Deleting all open resources from previous runs. on_ready is called again after reconnects, but then the
+    # resources belong to running games
+    global resources_cleaned_up
+    if not resources_cleaned_up:
+        resources_cleaned_up = True
+        await clean_up_resources()
+
+
+async def clean_up_resources():
+    """
+    Deletes the roles and waiting channels that games of previous runs did not delete (e.g. because of a crash).
+    The roles of the reusable role lockout are kept, but removed from the members that still have them.
+    These are the ones recorded in the database and - as the last changes might not have been flushed to the database
+    before a crash (see resource_journal.py) - the ones that are recognizable by their names (and for channels, by the
+    marker in their topic)
+    """
+    await resource_journal.flush()
+    deleted = set()
+    for (resource_type, lookup) in (("role", discord.Guild.get_role), ("text_channel", discord.Guild.get_channel)):
+        entries = await dba.get_resources(resource_type=resource_type)
+        for entry in entries or []:
+            guild = bot.get_guild(entry.guild_id)
+            resource = lookup(guild, entry.value) if guild else None
+            try:
+                if resource:
+                    await resource.delete()
+                    deleted.add(resource.id)
+            except discord.HTTPException:
+                print(f'{resource_type} not found on this server')
+            # Delete resource from database now
+            resource_journal.delete(entry.guild_id, value=entry.value, resource_type=resource_type)
+
+    # The roles of the reusable role lockout (see lockout.py) are kept as long as their channel exists
+    for entry in await dba.get_resources(resource_type="guesser_role") or []:
+        guild = bot.get_guild(entry.guild_id)
+        role = guild.get_role(entry.value) if guild else None
+        if role and any(role in channel.overwrites for channel in guild.text_channels):
+            deleted.add(role.id)  # Exclude it from the leftovers
+            # Members that had the role when the previous run stopped would be locked out for good
+            for member in role.members:
+                try:
+                    await member.remove_roles(role, reason="Left locked out by a previous run")
+                    logger.info(f'[Guild {guild.id}] Let member {member.id} back into the channel of role {role.id}')
+                except discord.HTTPException:
+                    logger.warning(f'[Guild {guild.id}] Could not remove guesser role {role.id} from {member.id}')
+            continue
+        try:
+            if role:
+                await role.delete(reason="Channel of the role does not exist anymore")
+        except discord.HTTPException:
+            logger.warning(f'[Guild {entry.guild_id}] Could not delete guesser role {entry.value}')
+        resource_journal.delete(entry.guild_id, value=entry.value, resource_type="guesser_role")
+
+    for g in bot.guilds:
+        leftovers = [role for role in g.roles if role.name.startswith(f'{ROLE_NAME}: #')]
+        leftovers += [channel for channel in g.text_channels if is_waiting_channel(channel)]
+        for resource in leftovers:
+            if resource.id in deleted:
+                continue
+            try:
+                await resource.delete(reason="Left over from a previous run")
+                logger.info(f'[Guild {g.id}] Deleted left over {resource}')
+            except discord.HTTPException:
+                logger.warning(f'[Guild {g.id}] Could not delete left over {resource}')
+    await resource_journal.flush()
+
+
+def is_waiting_channel(channel: discord.TextChannel) -> bool:
+    """
+    :param channel: channel to check
+    :return: whether the channel is an admin waiting channel created by the bot: it has the name and the topic of one
+             (the topic contains the id of the bot) and it is hidden for everyone except the bot (and the guesser)
+    """
+    if channel.topic != output.admin_channel_topic(channel.guild.me):
+        return False
+    suffix = output.admin_channel_name(channel)[len(channel.name):].lower()  # Discord lowercases channel names
+    if not channel.name.endswith(suffix):
+        return False
+    overwrites = channel.overwrites
+    return overwrites.get(channel.guild.default_role, discord.PermissionOverwrite()).read_messages is False \
+        and channel.guild.me in overwrites
 
 
 @bot.event
 async def on_message(message: discord.Message):
-    while_in_game_commands = [f'{PREFIX}abort']
-    game = find_game(message.channel)
-    if game is None or game.phase.value >= 130:
-        await bot.process_commands(message)
-        return
-    for always_command in while_in_game_commands:
-        if message.content.startswith(always_command):
-            await bot.process_commands(message)
-            return
-    if message.content.startswith(PREFIX):
-        await game.message_sender.send_message(embed=output.game_running_warning(), reaction=False, group=Group.warn)
+    await router.route(message)
 
 
 # LOADING Extensions
@@ -94,3 +148,4 @@ if __name__ == '__main__':
         bot.load_extension(extension)
 
     bot.run(TOKEN)
+    resource_journal.flush_blocking()  # Don't lose the resource changes of the last seconds
@@ -1,5 +1,6 @@
+import asyncio
 import logging
-from typing import List
+from typing import Dict, List, Set
 
 import discord
 
@@ -9,29 +10,97 @@ import permission_management.admin as admin
 
 logger = logging.getLogger('my-bot')
 
+"""
+The moderator roles of all guilds are kept in memory, so that checking permissions never touches the database.
+The index is loaded once at startup (see load_mod_roles) and kept up to date by toggle_mod (see add_mod_role and
+remove_mod_role) and by the on_guild_role_delete listener.
+"""
 
-def get_mod_roles(guild: discord.Guild) -> List[discord.Member]:
+mod_role_ids: Dict[int, Set[int]] = {}  # Indexed by guild id
+_background_tasks: Set[asyncio.Task] = set()  # Strong references to the running pruning tasks
+
+
+async def load_mod_roles():
+    """
+    (Re)loads the moderator roles of all guilds from the database
+    """
+    entries = await dba.get_all_settings(setting="mod-role")
+    mod_role_ids.clear()
+    for entry in entries or []:
+        mod_role_ids.setdefault(entry.guild_id, set()).add(int(entry.value))
+    logger.info(f'Loaded {len(entries or [])} moderator roles of {len(mod_role_ids)} guilds')
+
+
+def add_mod_role(guild_id: int, role_id: int):
+    """
+    Adds a role to the moderator roles of a guild in memory. The caller is responsible for the database entry.
+
+    :param guild_id: guild the role is in
+    :param role_id: id of the role
+    """
+    mod_role_ids.setdefault(guild_id, set()).add(role_id)
+
+
+def remove_mod_role(guild_id: int, role_id: int) -> bool:
+    """
+    Removes a role from the moderator roles of a guild in memory. The caller is responsible for the database entry.
+
+    :param guild_id: guild the role is in
+    :param role_id: id of the role
+
+    :return: Whether the role was a moderator role
+    """
+    roles = mod_role_ids.get(guild_id)
+    if not roles or role_id not in roles:
+        return False
+    roles.discard(role_id)
+    if not roles:
+        del mod_role_ids[guild_id]
+    return True
+
+
+def prune_mod_role(guild: discord.Guild, role_id: int):
+    """
+    Removes a role that does not exist anymore from the moderator roles. The database entry is deleted in the
+    background.
+
+    :param guild: guild the role was in
+    :param role_id: id of the role
+    """
+    if not remove_mod_role(guild.id, role_id):
+        return
+    logger.info(f"{guild.name}: Can't find role with ID {role_id} - removing.")
+    task = asyncio.ensure_future(dba.del_setting(guild.id, str(role_id), setting="mod-role"))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def is_mod_role(guild_id: int, role_id: int) -> bool:
+    """
+    :param guild_id: guild the role is in
+    :param role_id: id of the role
+
+    :return: Whether the role has moderator permissions
+    """
+    return role_id in mod_role_ids.get(guild_id, ())
+
+
+def get_mod_roles(guild: discord.Guild) -> List[discord.Role]:
     """
     Gets all roles that have moderator permissions inside the bot.\n
-    Removes roles that the bot can't find from database
+    Removes roles that the bot can't find
 
     :param guild: guild to search on
 
     :return: List of all (moderator) roles (discord object) that the bot can find on the guild
     """
-    # load roles
-    entries = dba.get_settings_for(guild.id, setting="mod-role")
-    if not entries:
-        return []
     roles = []
-    for entry in entries:
-        role = guild.get_role(int(entry.value))
+    for role_id in list(mod_role_ids.get(guild.id, ())):
+        role = guild.get_role(role_id)
         # if role can't be extracted it's probably deleted and should be removed
         if not role:
-            logger.info(f"{guild.name}: Can't find role with ID {entry.value} - removing.")
-            dba.del_setting(guild.id, entry.value, entry.setting)
+            prune_mod_role(guild, role_id)
             continue
-
         roles.append(role)
     return roles
 
@@ -49,11 +118,6 @@ def is_moderator(member: discord.Member) -> bool:
     if admin.is_guild_admin(member):
         return True
 
-    # load mod roles
-    # extract only role-ids from role objects
-    mod_role_ids = set([r.id for r in get_mod_roles(member.guild)])
-    member_role_ids = set([r.id for r in member.roles])
     # intersecting sets to see if any role id is in both sets which means that user has mod perms
-    intersect = mod_role_ids & member_role_ids
-
-    return True if intersect else False
+    mod_roles = mod_role_ids.get(member.guild.id)
+    return bool(mod_roles) and not mod_roles.isdisjoint(r.id for r in member.roles)